@@ -2,6 +2,8 @@
 ASGI config for chameco project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The system is served via WSGI by default (see the README); this entry point
+is only needed for the key events stream (chaves/eventos/).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -97,3 +97,32 @@ setores_usa_sistema_livremente = [
 tipos_admin = ["admin", "ti"]
 
 setores_admin = ["ti"]
+
+tipos_login = [
+    "admin",
+    "ti",
+    "coordenador",
+    "aluno",
+    "serv.terceirizado",
+    "professor",
+    "tec.administrativo",
+    "engenheiro",
+    "enfermeiro",
+    "medico",
+    "nutricionista",
+    "odontologo",
+    "pedagogo",
+    "psicologo",
+    "vigilante",
+]
+
+setores_login = [
+    "ti",
+    "guarita",
+    "coordenacao de disciplina",
+    "direcao geral",
+    "direcao de ensino",
+    "vigilante",
+    "limpeza",
+    "aux. cozinha",
+]
@@ -1,12 +1,17 @@
 import os
+import time
 from datetime import timedelta
 from typing import Callable
 
+import jwt
 import requests
 from django.utils import timezone
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from .models import Tokens
+from .cache import TTLCache
+from .models import Sessoes
 
 load_dotenv()
 
@@ -14,6 +19,72 @@ url_base = os.environ.get("urlBase")
 
 URL_BASE_TOKEN = f"{url_base}cortex/api/token/"
 
+URL_BASE_USERS = f"{url_base}cortex/api/gerusuarios/v1/users/"
+
+# Tokens já verificados no Cortex ficam guardados em memória até pouco antes
+# do "exp" do access token, evitando uma chamada ao "token/verify/" por requisição
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("tokenCacheMaxSize", 2048))
+TOKEN_CACHE_MARGEM = int(os.environ.get("tokenCacheMargem", 30))
+
+verified_tokens = TTLCache(max_size=TOKEN_CACHE_MAX_SIZE)
+
+# Perfis de usuários do Cortex (nome, tipo, setores...) compartilhados pelas permissões
+CORTEX_USER_CACHE_MAX_SIZE = int(os.environ.get("cortexUserCacheMaxSize", 1024))
+CORTEX_USER_CACHE_TTL = int(os.environ.get("cortexUserCacheTTL", 60))
+
+cortex_users = TTLCache(max_size=CORTEX_USER_CACHE_MAX_SIZE)
+
+# Configurações do cliente HTTP usado nas chamadas ao Cortex (valem por worker)
+CORTEX_POOL_SIZE = int(os.environ.get("cortexPoolSize", 10))
+CORTEX_CONNECT_TIMEOUT = float(os.environ.get("cortexConnectTimeout", 3.05))
+CORTEX_READ_TIMEOUT = float(os.environ.get("cortexReadTimeout", 15))
+CORTEX_RETRIES = int(os.environ.get("cortexRetries", 2))
+
+# Intervalo, em segundos, da limpeza de tokens expirados feita pelo próprio processo (0 desativa)
+TOKEN_PURGE_INTERVAL = int(os.environ.get("tokenPurgeInterval", 3600))
+
+ultima_limpeza = None
+
+METODOS_SUPORTADOS = {"get", "post", "put", "patch", "delete"}
+
+
+def buildCortexSession() -> requests.Session:
+    """
+    Cria a sessão HTTP compartilhada com o Cortex, mantendo as conexões abertas
+    (keep-alive) entre requisições. O retry com backoff só é aplicado em métodos
+    idempotentes, ou em falhas de conexão, quando a requisição nem chegou ao Cortex.
+    """
+    retry = Retry(
+        total=CORTEX_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=CORTEX_POOL_SIZE,
+        pool_maxsize=CORTEX_POOL_SIZE,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+cortex_session = buildCortexSession()
+
+
+def cortexRequest(method: str, url: str, **kwargs) -> requests.Response:
+    if method.lower() not in METODOS_SUPORTADOS:
+        raise ValueError(f"Método {method} não é suportado.")
+
+    kwargs.setdefault("timeout", (CORTEX_CONNECT_TIMEOUT, CORTEX_READ_TIMEOUT))
+
+    return cortex_session.request(method.upper(), url, **kwargs)
+
 
 def requestFactory(
     method: str,
@@ -21,9 +92,7 @@ def requestFactory(
     hash_token: str,
     body: dict[str, str] | None = None,
 ):
-    request = getattr(requests, method.lower(), None)
-
-    if request is None:
+    if method.lower() not in METODOS_SUPORTADOS:
         raise ValueError(f"Método {method} não é suportado.")
 
     # Testa todos as possibilidades possíveis de obter a autenticação, se não for possível retorna False
@@ -44,26 +113,62 @@ def requestFactory(
     access = auth["access"]
     header = {"Authorization": f"Bearer {access}"}
 
-    response = request(url, json=body, headers=header)
+    response = cortexRequest(method, url, json=body, headers=header)
 
     return response
 
 
-def getTokens(hash_token: str) -> dict[str, str | None] | None:
-    Tokens.objects.filter(data_expiracao__lt=timezone.now()).delete()
+def getSessao(hash_token: str) -> Sessoes | None:
+    # Registros expirados são apenas ignorados, a remoção fica a cargo de purgeExpiredTokens
+    if not hash_token:
+        return None
 
-    access = None
-    refresh = None
+    return Sessoes.objects.filter(
+        hash_token=hash_token, data_expiracao__gt=timezone.now()
+    ).first()
 
-    try:
-        access = Tokens.objects.get(hash_token=f"{hash_token}_access").valor
-    except:
-        pass
 
-    try:
-        refresh = Tokens.objects.get(hash_token=f"{hash_token}_refresh").valor
-    except:
-        pass
+def valorValido(valor, expiracao) -> str | int | None:
+    if valor is None or not expiracao or expiracao <= timezone.now():
+        return None
+
+    return valor
+
+
+def purgeExpiredTokens() -> int:
+    deleted, _ = Sessoes.objects.filter(data_expiracao__lt=timezone.now()).delete()
+
+    return deleted
+
+
+def maybePurgeExpiredTokens():
+    """
+    Limpeza periódica dentro do próprio processo, executada no máximo uma vez a
+    cada "tokenPurgeInterval" segundos e apenas no caminho de login.
+    O comando "purge_tokens" pode ser agendado no lugar desta rotina.
+    """
+    global ultima_limpeza
+
+    if TOKEN_PURGE_INTERVAL <= 0:
+        return
+
+    agora = time.monotonic()
+
+    if ultima_limpeza and agora - ultima_limpeza < TOKEN_PURGE_INTERVAL:
+        return
+
+    ultima_limpeza = agora
+    purgeExpiredTokens()
+
+
+def getTokens(hash_token: str) -> dict[str, str | None] | None:
+    sessao = getSessao(hash_token)
+
+    if not sessao:
+        return None
+
+    access = valorValido(sessao.access, sessao.expiracao_access)
+    refresh = valorValido(sessao.refresh, sessao.expiracao_refresh)
 
     if not access and not refresh:
         return None
@@ -72,46 +177,49 @@ def getTokens(hash_token: str) -> dict[str, str | None] | None:
 
 
 def setTokens(hash_token: str, access: str, refresh: str):
-    Tokens.objects.update_or_create(
-        hash_token=f"{hash_token}_access",
-        defaults={
-            "valor": access,
-            "data_expiracao": timezone.now() + timedelta(days=1),
-        },
-    )
-    Tokens.objects.update_or_create(
-        hash_token=f"{hash_token}_refresh",
+    maybePurgeExpiredTokens()
+
+    agora = timezone.now()
+
+    Sessoes.objects.update_or_create(
+        hash_token=hash_token,
         defaults={
-            "valor": refresh,
-            "data_expiracao": timezone.now() + timedelta(days=7),
+            "access": access,
+            "expiracao_access": agora + timedelta(days=1),
+            "refresh": refresh,
+            "expiracao_refresh": agora + timedelta(days=7),
+            "data_expiracao": agora + timedelta(days=7),
         },
     )
 
+    # Os tokens acabaram de ser emitidos pelo Cortex, não há necessidade de verificá-los
+    cacheVerifiedTokens(hash_token, {"access": access, "refresh": refresh})
+
 
 def setIdUser(hash_token: str, id_user: int):
-    Tokens.objects.update_or_create(
-        hash_token=f"{hash_token}_id_user",
+    agora = timezone.now()
+
+    Sessoes.objects.update_or_create(
+        hash_token=hash_token,
         defaults={
-            "valor": str(id_user),
-            "data_expiracao": timezone.now() + timedelta(days=1),
+            "id_user": id_user,
+            "expiracao_id_user": agora + timedelta(days=1),
+        },
+        create_defaults={
+            "id_user": id_user,
+            "expiracao_id_user": agora + timedelta(days=1),
+            "data_expiracao": agora + timedelta(days=1),
         },
     )
 
 
 def getIdUser(hash_token: str) -> int | None:
-    Tokens.objects.filter(data_expiracao__lt=timezone.now()).delete()
+    sessao = getSessao(hash_token)
 
-    id_user = None
-
-    try:
-        id_user = Tokens.objects.get(hash_token=f"{hash_token}_id_user").valor
-    except:
-        pass
-
-    if not id_user:
+    if not sessao:
         return None
 
-    return int(id_user)
+    return valorValido(sessao.id_user, sessao.expiracao_id_user)
 
 
 def verifyToken(hash_token: str) -> bool:
@@ -122,7 +230,7 @@ def verifyToken(hash_token: str) -> bool:
     else:
         return False
 
-    response = requests.post(url=f"{URL_BASE_TOKEN}verify/", json=data)
+    response = cortexRequest("post", f"{URL_BASE_TOKEN}verify/", json=data)
 
     if response.status_code != 200:
         return False
@@ -138,28 +246,63 @@ def refreshToken(hash_token: str) -> bool:
     else:
         return False
 
-    response = requests.post(url=f"{URL_BASE_TOKEN}refresh/", json=data)
+    response = cortexRequest("post", f"{URL_BASE_TOKEN}refresh/", json=data)
 
     if response.status_code != 200:
-        Tokens.objects.filter(hash_token=f"{hash_token}_access").delete()
-        Tokens.objects.filter(hash_token=f"{hash_token}_refresh").delete()
+        verified_tokens.delete(hash_token)
+        Sessoes.objects.filter(hash_token=hash_token).update(
+            access=None,
+            expiracao_access=None,
+            refresh=None,
+            expiracao_refresh=None,
+        )
 
         return False
 
     data = response.json()
 
-    setTokens(hash_token, data["access"], refresh)
+    setTokens(hash_token, data["access"], refresh["refresh"])
 
     return True
 
 
+def getTokenTTL(access: str | None) -> float:
+    """
+    Calcula por quantos segundos a verificação do access token pode ser
+    reaproveitada, a partir do "exp" do JWT, descontando uma margem de segurança.
+    """
+    if not access:
+        return 0
+
+    try:
+        exp = jwt.decode(access, options={"verify_signature": False})["exp"]
+    except (jwt.InvalidTokenError, KeyError, TypeError):
+        return 0
+
+    return exp - time.time() - TOKEN_CACHE_MARGEM
+
+
+def cacheVerifiedTokens(hash_token: str, auth: dict[str, str | None] | None):
+    if not auth:
+        return
+
+    verified_tokens.set(hash_token, auth, getTokenTTL(auth["access"]))
+
+
 def isTokenValid(hash_token: str) -> dict[str, str | None] | bool:
+    auth = verified_tokens.get(hash_token)
+
+    if auth:
+        return auth
+
     if verifyToken(hash_token):
         auth = getTokens(hash_token)
+        cacheVerifiedTokens(hash_token, auth)
         return auth
 
     elif refreshToken(hash_token):
         auth = getTokens(hash_token)
+        cacheVerifiedTokens(hash_token, auth)
         return auth
 
     else:
@@ -173,3 +316,38 @@ def isAuthenticated(hash_token: str) -> bool:
         isAuthenticated = True
 
     return isAuthenticated
+
+
+def getCortexUser(id_user: int | None, hash_token: str) -> dict | None:
+    """
+    Busca o perfil do usuário no Cortex, reaproveitando por alguns segundos o
+    resultado de buscas anteriores do mesmo usuário. Retorna None caso o usuário
+    não exista ou o token não seja válido.
+    """
+    if not id_user:
+        return None
+
+    usuario = cortex_users.get(int(id_user))
+
+    if usuario is not None:
+        if not isTokenValid(hash_token):
+            return None
+
+        return usuario
+
+    response = requestFactory("get", f"{URL_BASE_USERS}{id_user}", hash_token)
+
+    if not response:
+        return None
+
+    usuario = response.json()
+    cortex_users.set(int(id_user), usuario, CORTEX_USER_CACHE_TTL)
+
+    return usuario
+
+
+def invalidateCortexUser(id_user: int | None = None):
+    if id_user is None:
+        cortex_users.clear()
+    else:
+        cortex_users.delete(int(id_user))
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    Cache em memória do processo (cada worker do gunicorn possui o seu), com
+    tamanho máximo e descarte LRU. Cada item possui o seu próprio tempo de vida.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                return None
+
+            value, expires_at = item
+
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        if ttl <= 0 or self.max_size <= 0:
+            self.delete(key)
+            return
+
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
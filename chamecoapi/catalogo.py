@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+
+from django.db import transaction
+from dotenv import load_dotenv
+
+from .models import Blocos, Chaves, Salas
+from .versoes import obterVersoes, periodoVersoes
+
+load_dotenv()
+
+# Intervalo, em segundos, entre as consultas ao contador "catalogo", que é como
+# um worker percebe as alterações feitas pelos outros
+CATALOGO_VERIFICACAO = float(os.environ.get("catalogoVerificacao", 5))
+
+# Campos das chaves alterados pelos empréstimos, que não fazem parte do catálogo
+CAMPOS_EMPRESTIMO = frozenset({"disponivel", "emprestimo_atual"})
+
+
+def montarArvore() -> tuple:
+    """
+    Monta a árvore do campus como tuplas: (id, nome, salas) para os blocos,
+    (id, nome, chaves) para as salas e (id, descricao, principal) para as
+    chaves, na ordem por nome de blocos e salas.
+    """
+    chaves = {}
+
+    for chave_id, sala_id, descricao, principal in Chaves.objects.values_list(
+        "id", "sala_id", "descricao", "principal"
+    ).order_by("id"):
+        chaves.setdefault(sala_id, []).append((chave_id, descricao, principal))
+
+    salas = {}
+
+    for sala_id, bloco_id, nome in Salas.objects.values_list(
+        "id", "bloco_id", "nome"
+    ).order_by("nome", "id"):
+        salas.setdefault(bloco_id, []).append((sala_id, nome, tuple(chaves.get(sala_id, ()))))
+
+    return tuple(
+        (bloco_id, nome, tuple(salas.get(bloco_id, ())))
+        for bloco_id, nome in Blocos.objects.values_list("id", "nome").order_by("nome", "id")
+    )
+
+
+def serializarArvore(arvore: tuple) -> bytes:
+    blocos = [
+        {
+            "id": bloco_id,
+            "nome": bloco_nome,
+            "salas": [
+                {
+                    "id": sala_id,
+                    "nome": sala_nome,
+                    "chaves": [
+                        {"id": chave_id, "descricao": descricao, "principal": principal}
+                        for chave_id, descricao, principal in chaves
+                    ],
+                }
+                for sala_id, sala_nome, chaves in salas
+            ],
+        }
+        for bloco_id, bloco_nome, salas in arvore
+    ]
+
+    return json.dumps(blocos, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class Catalogo:
+    """
+    Árvore blocos > salas > chaves guardada em memória pelo worker, junto com
+    o JSON já pronto do endpoint campus/. Os signals deste worker invalidam a
+    árvore assim que a transação é confirmada; as alterações feitas em outros
+    workers aparecem na próxima verificação do contador "catalogo", feita no
+    máximo a cada CATALOGO_VERIFICACAO segundos. A versão guardada inclui o
+    período de versoes.periodoVersoes, então a árvore também é montada de novo
+    ao fim de cada período, caso algum incremento do contador tenha falhado.
+    """
+
+    def __init__(self):
+        self.versao = None
+        self.arvore = ()
+        self.conteudo = b""
+        self._verificado_em = None
+        self._lock = threading.Lock()
+
+    def obter(self) -> tuple[tuple[int, int], tuple, bytes]:
+        with self._lock:
+            agora = time.monotonic()
+
+            if self._verificado_em is None or agora - self._verificado_em >= CATALOGO_VERIFICACAO:
+                # A versão é lida antes da árvore: se as duas divergirem, a
+                # árvore é a mais nova e só será montada de novo sem necessidade
+                versao = (*obterVersoes("catalogo"), periodoVersoes())
+
+                if versao != self.versao:
+                    self.arvore = montarArvore()
+                    self.conteudo = serializarArvore(self.arvore)
+                    self.versao = versao
+
+                self._verificado_em = agora
+
+            return self.versao, self.arvore, self.conteudo
+
+    def invalidar(self):
+        # Força a verificação da versão na próxima leitura
+        self._verificado_em = None
+
+    def clear(self):
+        with self._lock:
+            self.versao = None
+            self.arvore = ()
+            self.conteudo = b""
+            self._verificado_em = None
+
+
+catalogo = Catalogo()
+
+
+def invalidarCatalogo():
+    # Antes da confirmação, outra requisição ainda leria a versão antiga
+    transaction.on_commit(catalogo.invalidar)
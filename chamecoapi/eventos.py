@@ -0,0 +1,362 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import AsyncIterator, Callable, Iterable
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .models import EventosChaves
+
+load_dotenv()
+
+# Intervalo, em segundos, entre as consultas de novos eventos feitas por cada processo
+EVENTOS_INTERVALO = float(os.environ.get("eventosIntervalo", 1))
+# Segundos sem eventos até o envio de um comentário que mantém a conexão aberta
+EVENTOS_HEARTBEAT = float(os.environ.get("eventosHeartbeat", 15))
+# Duração máxima de cada conexão; o navegador reconecta sozinho com o Last-Event-ID
+EVENTOS_DURACAO = float(os.environ.get("eventosDuracao", 300))
+# Tempo, em segundos, em que os eventos ficam guardados para a reconexão dos painéis
+EVENTOS_RETENCAO = float(os.environ.get("eventosRetencao", 86400))
+# Intervalo, em segundos, da limpeza de eventos antigos feita pela própria aplicação
+EVENTOS_PURGE_INTERVAL = int(os.environ.get("eventosPurgeInterval", 3600))
+
+EVENTOS_LOTE = 100
+# Folga para a diferença entre o relógio da aplicação (criado_em) e o do banco
+EVENTOS_FOLGA_RELOGIO = timedelta(minutes=1)
+
+ultima_limpeza = None
+
+logger = logging.getLogger(__name__)
+
+
+def registrarEventoChave(chave_id: int, tipo: str, disponivel: bool | None):
+    # Deve ser chamado na mesma transação da alteração da chave
+    EventosChaves.objects.create(chave=chave_id, tipo=tipo, disponivel=disponivel)
+
+
+def registrarEventosChaves(chaves_ids: Iterable[int], tipo: str, disponivel: bool | None):
+    EventosChaves.objects.bulk_create(
+        EventosChaves(chave=chave_id, tipo=tipo, disponivel=disponivel)
+        for chave_id in chaves_ids
+    )
+
+
+def ultimoEvento() -> int:
+    return EventosChaves.objects.aggregate(ultimo=Max("id"))["ultimo"] or 0
+
+
+def purgarEventos() -> int:
+    """
+    Remove os eventos mais antigos que EVENTOS_RETENCAO, mantendo sempre o
+    último, que é o ponto de partida do leitor de cada processo (ver
+    LeitorEventos.iniciar). Um painel que reconecte com um Last-Event-ID já
+    removido apenas não recebe os eventos perdidos.
+    """
+    limite = timezone.now() - timedelta(seconds=EVENTOS_RETENCAO)
+    removidos, _ = EventosChaves.objects.filter(
+        criado_em__lt=limite, id__lt=ultimoEvento()
+    ).delete()
+
+    return removidos
+
+
+def talvezPurgarEventos():
+    """
+    Limpeza periódica dentro do próprio processo, executada no máximo uma vez a
+    cada "eventosPurgeInterval" segundos, na abertura das conexões do stream.
+    O comando "purge_eventos" pode ser agendado no lugar desta rotina.
+    """
+    global ultima_limpeza
+
+    if EVENTOS_PURGE_INTERVAL <= 0:
+        return
+
+    agora = time.monotonic()
+
+    if ultima_limpeza and agora - ultima_limpeza < EVENTOS_PURGE_INTERVAL:
+        return
+
+    ultima_limpeza = agora
+    purgarEventos()
+
+
+def semConexao(funcao: Callable) -> Callable:
+    """
+    Executa "funcao" em uma thread do executor e fecha a conexão com o banco
+    dessa thread ao final, para que as conexões abertas do stream não
+    mantenham uma conexão com o banco entre uma consulta e outra.
+    """
+
+    def executar(*args):
+        try:
+            return funcao(*args)
+        finally:
+            connection.close()
+
+    return sync_to_async(executar, thread_sensitive=False)
+
+
+def consultarTransacoes():
+    """
+    Retorna o horário atual do banco e o início da transação mais antiga ainda
+    aberta nas outras conexões (None se não houver nenhuma).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT clock_timestamp(), min(xact_start) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND backend_type = 'client backend' "
+            "AND pid <> pg_backend_pid()"
+        )
+        return cursor.fetchone()
+
+
+class LeitorEventos:
+    """
+    Acompanha a sequência de ids dos eventos. Um id que falta antes do maior
+    já lido pode ser de uma transação ainda não confirmada, por mais longa que
+    seja, então fica em "pendentes" e é consultado de novo a cada leitura. Só
+    deixa de ser esperado quando todas as transações abertas começaram depois
+    que a lacuna foi vista, ou seja, quando a transação que reservou o id já
+    terminou sem gravá-lo (rollback).
+    """
+
+    def __init__(self):
+        self.maximo = 0
+        # id -> horário do banco em que a lacuna já existia (None até a próxima verificação)
+        self.pendentes = {}
+
+    @property
+    def cursor(self) -> int:
+        # Todos os ids até aqui já foram lidos ou descartados
+        return min(self.pendentes) - 1 if self.pendentes else self.maximo
+
+    def iniciar(self) -> int:
+        _, mais_antiga = consultarTransacoes()
+        self.maximo = ultimoEvento()
+        self.pendentes = {}
+
+        if mais_antiga is not None:
+            # Os eventos gravados antes do início da transação aberta mais antiga
+            # têm ids menores que os de qualquer transação ainda em andamento
+            eventos = EventosChaves.objects.filter(id__lte=self.maximo).order_by("-id")
+            limite = eventos.filter(
+                criado_em__lt=mais_antiga - EVENTOS_FOLGA_RELOGIO
+            ).values_list("id", flat=True).first()
+
+            if limite is None:
+                limite = (eventos.aggregate(menor=Min("id"))["menor"] or 1) - 1
+
+            existentes = set(eventos.filter(id__gt=limite).values_list("id", flat=True))
+            self.pendentes = {
+                id: None for id in range(limite + 1, self.maximo + 1) if id not in existentes
+            }
+
+        return self.cursor
+
+    def ler(self) -> tuple[list[EventosChaves], int]:
+        """
+        Retorna os eventos novos e os das lacunas que foram confirmados desde a
+        última leitura (fora da ordem dos ids) e o cursor atualizado.
+        """
+        descartaveis = set()
+
+        if self.pendentes:
+            agora, mais_antiga = consultarTransacoes()
+
+            for id, vista_em in self.pendentes.items():
+                if vista_em is None:
+                    self.pendentes[id] = vista_em = agora
+
+                # A transação que reservou o id terminou antes desta consulta: se
+                # foi confirmada o evento aparece na leitura abaixo
+                if mais_antiga is None or mais_antiga > vista_em:
+                    descartaveis.add(id)
+
+        eventos = []
+
+        while True:
+            lote = list(
+                EventosChaves.objects.filter(
+                    Q(id__gt=self.maximo) | Q(id__in=list(self.pendentes))
+                ).order_by("id")[:EVENTOS_LOTE]
+            )
+
+            for evento in lote:
+                if evento.id in self.pendentes:
+                    del self.pendentes[evento.id]
+                    continue
+
+                for id in range(self.maximo + 1, evento.id):
+                    self.pendentes[id] = None
+
+                self.maximo = evento.id
+
+            eventos.extend(lote)
+
+            if len(lote) < EVENTOS_LOTE:
+                break
+
+        for id in descartaveis:
+            self.pendentes.pop(id, None)
+
+        return eventos, self.cursor
+
+
+class DistribuidorEventos:
+    """
+    Uma única consulta periódica por processo, repassada às filas das conexões
+    abertas. A consulta só roda enquanto há conexões e cada leitura usa uma
+    conexão com o banco que é fechada em seguida (ver semConexao).
+    """
+
+    def __init__(self):
+        self.cursor = 0
+        self.filas = set()
+        self._tarefa = None
+        self._pronto = None
+
+    async def inscrever(self) -> asyncio.Queue:
+        if self._tarefa is None or self._tarefa.done():
+            loop = asyncio.get_running_loop()
+            self._pronto = loop.create_future()
+            self._tarefa = loop.create_task(self._consultar(self._pronto))
+
+        fila = asyncio.Queue()
+        self.filas.add(fila)
+
+        try:
+            await asyncio.shield(self._pronto)
+        except BaseException:
+            self.cancelar(fila)
+            raise
+
+        return fila
+
+    def cancelar(self, fila: asyncio.Queue):
+        self.filas.discard(fila)
+
+        if not self.filas and self._tarefa is not None:
+            # A próxima inscrição já cria outra consulta, sem esperar o cancelamento
+            self._tarefa.cancel()
+            self._tarefa = None
+
+    async def _consultar(self, pronto: asyncio.Future):
+        # Um leitor novo a cada início: o anterior pode ter ficado parado por muito tempo
+        leitor = LeitorEventos()
+
+        try:
+            self.cursor = await semConexao(leitor.iniciar)()
+        except Exception as erro:
+            pronto.set_exception(erro)
+            return
+
+        pronto.set_result(None)
+
+        while True:
+            await asyncio.sleep(EVENTOS_INTERVALO)
+
+            try:
+                eventos, cursor = await semConexao(leitor.ler)()
+            except Exception:
+                logger.exception("Falha ao consultar os eventos das chaves")
+                continue
+
+            self.cursor = cursor
+
+            for fila in self.filas:
+                fila.put_nowait((eventos, cursor))
+
+
+distribuidor = DistribuidorEventos()
+
+
+def lerEventosDesde(ultimo_id: int) -> list[EventosChaves]:
+    return list(EventosChaves.objects.filter(id__gt=ultimo_id).order_by("id")[:EVENTOS_LOTE])
+
+
+def formatarEvento(evento: EventosChaves) -> str:
+    data = json.dumps(
+        {"chave": evento.chave, "tipo": evento.tipo, "disponivel": evento.disponivel}
+    )
+
+    return f"event: chave\ndata: {data}\n\n"
+
+
+async def streamEventos(ultimo_id: int | None) -> AsyncIterator[str]:
+    """
+    Envia os eventos seguintes a "ultimo_id" (sem ele, os seguintes ao cursor
+    do distribuidor) e depois os repassados pelo distribuidor. Os eventos
+    das lacunas podem chegar fora da ordem dos ids, então o "id" enviado ao
+    navegador é o cursor, até onde não falta mais nenhum evento, e não o id
+    do último evento; os eventos já enviados acima dele não são repetidos.
+
+    Servido apenas via ASGI, sem consultar o banco na thread da requisição:
+    enquanto a conexão fica aberta essa thread fica ociosa e sem conexão com
+    o banco, e a única consulta periódica é a do distribuidor do processo.
+    """
+    yield f"retry: {int(EVENTOS_INTERVALO * 1000) + 1000}\n\n"
+
+    fila = await distribuidor.inscrever()
+
+    try:
+        cursor = distribuidor.cursor
+
+        if ultimo_id is None:
+            ultimo_id = cursor
+
+        enviados = set()
+        recuperado = ultimo_id
+
+        # O que foi confirmado antes da inscrição e ainda não chegou ao navegador
+        while True:
+            eventos = await semConexao(lerEventosDesde)(recuperado)
+
+            for evento in eventos:
+                enviados.add(evento.id)
+                yield formatarEvento(evento)
+
+            if len(eventos) < EVENTOS_LOTE:
+                break
+
+            recuperado = eventos[-1].id
+
+        fim = time.monotonic() + EVENTOS_DURACAO
+        ultimo_envio = time.monotonic()
+
+        while True:
+            if cursor > ultimo_id:
+                ultimo_id = cursor
+                enviados = {id for id in enviados if id > ultimo_id}
+                yield f"id: {ultimo_id}\n\n"
+                ultimo_envio = time.monotonic()
+
+            agora = time.monotonic()
+
+            if agora >= fim:
+                return
+
+            try:
+                eventos, cursor = await asyncio.wait_for(
+                    fila.get(), min(fim, ultimo_envio + EVENTOS_HEARTBEAT) - agora
+                )
+            except asyncio.TimeoutError:
+                if time.monotonic() < fim:
+                    yield ": heartbeat\n\n"
+                    ultimo_envio = time.monotonic()
+
+                continue
+
+            for evento in eventos:
+                if evento.id > ultimo_id and evento.id not in enviados:
+                    enviados.add(evento.id)
+                    yield formatarEvento(evento)
+                    ultimo_envio = time.monotonic()
+    finally:
+        distribuidor.cancelar(fila)
@@ -0,0 +1,111 @@
+import csv
+import tempfile
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+from django.utils import timezone
+from openpyxl import Workbook
+
+# (campo do values_list, título da coluna)
+COLUNAS_EMPRESTIMOS = [
+    ("id", "ID"),
+    ("horario_emprestimo", "Horário do empréstimo"),
+    ("horario_devolucao", "Horário da devolução"),
+    ("chave_id", "Chave"),
+    ("chave__sala__nome", "Sala"),
+    ("chave__sala__bloco__nome", "Bloco"),
+    ("usuario_solicitante__nome", "Solicitante"),
+    ("usuario_responsavel__nome", "Responsável"),
+    ("observacao", "Observação"),
+]
+
+TAMANHO_LOTE = 2000
+# Itens lidos do iterador síncrono a cada passagem pela thread, via ASGI
+TAMANHO_BLOCO_ASYNC = 500
+# Bytes lidos por vez do arquivo da planilha
+TAMANHO_PARTE_ARQUIVO = 64 * 1024
+
+
+class Echo:
+    """
+    Pseudo-arquivo para o csv.writer: devolve a linha formatada em vez de
+    guardá-la, para que cada linha seja enviada assim que for gerada.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _valor(valor):
+    # O Excel não aceita datas com fuso, então tudo vai no horário local
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).replace(microsecond=0, tzinfo=None)
+
+    return valor
+
+
+def linhasEmprestimos(queryset: QuerySet) -> Iterator[tuple]:
+    """
+    Percorre os empréstimos com um cursor no servidor, TAMANHO_LOTE linhas por
+    vez, sem carregar o resultado inteiro na memória.
+    """
+    campos = [campo for campo, _ in COLUNAS_EMPRESTIMOS]
+
+    for linha in queryset.values_list(*campos).iterator(chunk_size=TAMANHO_LOTE):
+        yield tuple(_valor(valor) for valor in linha)
+
+
+def csvEmprestimos(queryset: QuerySet) -> Iterator[str]:
+    writer = csv.writer(Echo())
+
+    # BOM para o Excel reconhecer o arquivo como UTF-8
+    yield "\ufeff" + writer.writerow([titulo for _, titulo in COLUNAS_EMPRESTIMOS])
+
+    for linha in linhasEmprestimos(queryset):
+        yield writer.writerow(linha)
+
+
+def xlsxEmprestimos(queryset: QuerySet):
+    """
+    Gera a planilha no modo write-only do openpyxl, que escreve as linhas em
+    disco conforme são adicionadas, e devolve o arquivo temporário já
+    posicionado no início. O arquivo é apagado ao ser fechado.
+    """
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet("Empréstimos")
+    planilha.append([titulo for _, titulo in COLUNAS_EMPRESTIMOS])
+
+    for linha in linhasEmprestimos(queryset):
+        planilha.append(linha)
+
+    arquivo = tempfile.TemporaryFile()
+    workbook.save(arquivo)
+    arquivo.seek(0)
+
+    return arquivo
+
+
+def partesArquivo(arquivo) -> Iterator[bytes]:
+    return iter(lambda: arquivo.read(TAMANHO_PARTE_ARQUIVO), b"")
+
+
+async def iterarAsync(iterator: Iterator, tamanho: int = TAMANHO_BLOCO_ASYNC) -> AsyncIterator:
+    """
+    Consome um iterador síncrono, que pode usar o banco, em blocos de
+    "tamanho" itens na thread das views síncronas. Via ASGI, o Django junta
+    um iterador síncrono inteiro em uma lista antes de enviá-lo, o que
+    carregaria a exportação toda na memória.
+    """
+    proximoBloco = sync_to_async(lambda: list(islice(iterator, tamanho)))
+
+    while True:
+        bloco = await proximoBloco()
+
+        if not bloco:
+            return
+
+        for item in bloco:
+            yield item
@@ -0,0 +1,256 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from openpyxl import load_workbook
+from requests.adapters import HTTPAdapter
+
+API_URL = "http://localhost:8000/chameco/api/v1/"
+PASTA_PLANILHAS = "insert_users"
+TIPOS = ["alunos", "servidores", "terceirizados"]
+
+
+def somenteDigitos(valor) -> str:
+    return re.sub("[^0-9]", "", str(valor))
+
+
+def credenciais(tipo: str, linha: dict) -> dict:
+    """
+    Monta o corpo do login de cada tipo de planilha: alunos entram com CPF e
+    matrícula, servidores com a matrícula nos dois campos e terceirizados com
+    o CPF nos dois campos.
+    """
+    if tipo == "alunos":
+        return {
+            "cpf": somenteDigitos(linha["CPF"]),
+            "password": str(linha["Matrícula"]).lower(),
+        }
+
+    if tipo == "servidores":
+        cpf = somenteDigitos(linha["Matrícula"]) or str(linha["Matrícula"])
+        return {"cpf": cpf, "password": cpf}
+
+    cpf = somenteDigitos(linha["CPF"])
+    return {"cpf": cpf, "password": cpf}
+
+
+def lerPlanilha(caminho: str):
+    """
+    Lê a planilha no modo read-only do openpyxl, linha a linha, sem carregá-la
+    inteira na memória.
+    """
+    workbook = load_workbook(caminho, read_only=True)
+
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalhos = next(linhas, None) or []
+
+        for linha in linhas:
+            if all(celula is None for celula in linha):
+                continue
+
+            yield dict(zip(cabecalhos, linha))
+    finally:
+        workbook.close()
+
+
+class Checkpoint:
+    """
+    Arquivo com uma chave por linha ("tipo:cpf") de cada usuário já
+    importado, para que uma nova execução continue de onde a anterior parou.
+    """
+
+    def __init__(self, caminho: str, reiniciar: bool = False):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+        if reiniciar and os.path.exists(caminho):
+            os.remove(caminho)
+
+        self.concluidos = set()
+
+        if os.path.exists(caminho):
+            with open(caminho, encoding="utf-8") as arquivo:
+                self.concluidos = {linha.strip() for linha in arquivo if linha.strip()}
+
+        self._arquivo = open(caminho, "a", encoding="utf-8")
+
+    def __contains__(self, chave: str) -> bool:
+        return chave in self.concluidos
+
+    def marcar(self, chave: str):
+        with self._lock:
+            self.concluidos.add(chave)
+            self._arquivo.write(f"{chave}\n")
+            self._arquivo.flush()
+
+    def close(self):
+        self._arquivo.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa usuários em lote a partir das planilhas alunos.xlsx, "
+        "servidores.xlsx e terceirizados.xlsx, fazendo o login de cada um na "
+        "API (que precisa estar no ar) com várias requisições em paralelo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--api-url",
+            default=API_URL,
+            help=f"URL base da API (padrão {API_URL}).",
+        )
+        parser.add_argument(
+            "--pasta",
+            default=PASTA_PLANILHAS,
+            help=f"Pasta com as planilhas (padrão {PASTA_PLANILHAS}).",
+        )
+        parser.add_argument(
+            "--tipos",
+            nargs="+",
+            choices=TIPOS,
+            default=TIPOS,
+            help="Planilhas a importar (padrão: todas).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Número de logins simultâneos (padrão 8).",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=60,
+            help="Tempo máximo de cada login, em segundos (padrão 60).",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="Arquivo de checkpoint (padrão <pasta>/.importacao_usuarios).",
+        )
+        parser.add_argument(
+            "--reiniciar",
+            action="store_true",
+            help="Ignora o checkpoint e importa todos os usuários novamente.",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+
+        if workers < 1:
+            raise CommandError("--workers deve ser maior que zero.")
+
+        if not os.path.isdir(options["pasta"]):
+            raise CommandError(
+                f"Pasta {options['pasta']} não encontrada. Crie a pasta com as "
+                "planilhas ou indique outra em --pasta."
+            )
+
+        self.url_login = f"{options['api_url'].rstrip('/')}/login/"
+        self.timeout = options["timeout"]
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        checkpoint = Checkpoint(
+            options["checkpoint"]
+            or os.path.join(options["pasta"], ".importacao_usuarios"),
+            reiniciar=options["reiniciar"],
+        )
+
+        self.importados = 0
+        self.ignorados = 0
+        self.falhas = []
+        self._lock = threading.Lock()
+
+        # Limita as tarefas pendentes para a leitura das planilhas não correr
+        # muito à frente dos logins
+        vagas = threading.BoundedSemaphore(workers * 2)
+        inicio = time.monotonic()
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for tipo in options["tipos"]:
+                    caminho = os.path.join(options["pasta"], f"{tipo}.xlsx")
+
+                    if not os.path.exists(caminho):
+                        self.stderr.write(f"Planilha {caminho} não encontrada, ignorando.")
+                        continue
+
+                    for linha in lerPlanilha(caminho):
+                        try:
+                            body = credenciais(tipo, linha)
+                        except KeyError as erro:
+                            self._falha(tipo, linha, f"coluna {erro} ausente")
+                            continue
+
+                        chave = f"{tipo}:{body['cpf']}"
+
+                        if chave in checkpoint:
+                            self.ignorados += 1
+                            continue
+
+                        vagas.acquire()
+                        futuro = executor.submit(self._login, tipo, body, chave, checkpoint)
+                        futuro.add_done_callback(lambda _: vagas.release())
+        finally:
+            checkpoint.close()
+            self.session.close()
+
+        self._relatorio(time.monotonic() - inicio)
+
+    def _login(self, tipo, body, chave, checkpoint):
+        # Roda em uma thread do executor, cujas exceções ninguém consulta: toda
+        # falha precisa chegar ao relatório por aqui
+        try:
+            response = self.session.post(self.url_login, json=body, timeout=self.timeout)
+
+            if response.status_code != 200:
+                self._falha(tipo, body["cpf"], response.text)
+                return
+
+            # O corpo é lido antes de marcar o usuário como importado
+            data = response.json()
+            checkpoint.marcar(chave)
+        except Exception as erro:
+            self._falha(tipo, body["cpf"], f"{type(erro).__name__}: {erro}")
+            return
+
+        with self._lock:
+            self.importados += 1
+
+        self.stdout.write(f"Usuário '{data.get('nome')}' inserido (usuario={data.get('usuario')})")
+
+    def _falha(self, tipo, identificacao, mensagem):
+        with self._lock:
+            self.falhas.append((tipo, identificacao, mensagem))
+
+        self.stderr.write(f"Erro em {tipo} ({identificacao}): {mensagem}")
+
+    def _relatorio(self, duracao):
+        processados = self.importados + len(self.falhas)
+        vazao = processados / duracao if duracao else 0
+
+        self.stdout.write("")
+        self.stdout.write(
+            f"{processados} login(s) em {duracao:.1f}s ({vazao:.1f} usuários/s); "
+            f"{self.ignorados} já importado(s) anteriormente."
+        )
+
+        if self.falhas:
+            self.stdout.write(self.style.WARNING(f"{len(self.falhas)} falha(s):"))
+
+            for tipo, identificacao, mensagem in self.falhas:
+                self.stdout.write(f"  {tipo} ({identificacao}): {mensagem}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Concluído! {self.importados} usuário(s) importado(s)."
+        ))
@@ -1,6 +1,13 @@
-from django.core.management.base import BaseCommand
+import json
+import os
+
+import yaml
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from openpyxl import load_workbook
 
 from chamecoapi.models import Blocos, Chaves, Salas
+from chamecoapi.versoes import incrementarVersao
 
 BLOCOS = [
     {"nome": "Bloco A"},
@@ -144,18 +151,124 @@ SALAS = [
 ]
 
 
+def layoutPadrao():
+    # Layout do campus nas listas BLOCOS e SALAS acima: [(bloco, [salas])]
+    return [
+        (bloco["nome"], [sala["nome"] for sala in SALAS if sala["bloco"] == idx])
+        for idx, bloco in enumerate(BLOCOS, start=1)
+    ]
+
+
+def carregarLayout(caminho):
+    """
+    Lê o layout do campus de um arquivo JSON, YAML ou XLSX.
+
+    - JSON/YAML: lista de blocos (ou {"blocos": [...]}), cada um no formato
+      {"nome": "Bloco A", "salas": ["A01 / Diretoria geral", ...]};
+    - XLSX: primeira planilha com as colunas "Bloco" e "Sala", uma sala por linha.
+    """
+    extensao = os.path.splitext(caminho)[1].lower()
+
+    try:
+        if extensao == ".xlsx":
+            return _layoutXlsx(caminho)
+
+        with open(caminho, encoding="utf-8") as arquivo:
+            if extensao == ".json":
+                dados = json.load(arquivo)
+            elif extensao in (".yaml", ".yml"):
+                dados = yaml.safe_load(arquivo)
+            else:
+                raise CommandError(
+                    f"Formato de arquivo não suportado: '{extensao}'. Use .json, .yaml, .yml ou .xlsx."
+                )
+    except OSError as erro:
+        raise CommandError(f"Não foi possível ler o arquivo '{caminho}': {erro}")
+
+    if isinstance(dados, dict):
+        dados = dados.get("blocos")
+
+    if not isinstance(dados, list):
+        raise CommandError("O arquivo deve conter uma lista de blocos.")
+
+    layout = []
+
+    for bloco in dados:
+        if not isinstance(bloco, dict) or not bloco.get("nome"):
+            raise CommandError(f"Bloco inválido no arquivo: {bloco!r}")
+
+        salas = [
+            sala["nome"] if isinstance(sala, dict) else sala
+            for sala in bloco.get("salas") or []
+        ]
+        layout.append((str(bloco["nome"]), [str(sala) for sala in salas]))
+
+    return layout
+
+
+def _layoutXlsx(caminho):
+    workbook = load_workbook(caminho, read_only=True)
+
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalhos = [str(celula).strip().lower() for celula in next(linhas, ())]
+
+        if "bloco" not in cabecalhos or "sala" not in cabecalhos:
+            raise CommandError("A planilha deve ter as colunas 'Bloco' e 'Sala'.")
+
+        col_bloco = cabecalhos.index("bloco")
+        col_sala = cabecalhos.index("sala")
+
+        # dict mantém a ordem em que os blocos aparecem
+        layout = {}
+
+        for linha in linhas:
+            bloco, sala = linha[col_bloco], linha[col_sala]
+
+            if not bloco:
+                continue
+
+            salas = layout.setdefault(str(bloco).strip(), [])
+
+            if sala:
+                salas.append(str(sala).strip())
+    finally:
+        workbook.close()
+
+    return list(layout.items())
+
+
 class Command(BaseCommand):
     help = "Povoa o banco de dados com os blocos, salas e chaves iniciais do sistema."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--arquivo",
+            help="Arquivo JSON, YAML ou XLSX com o layout do campus (padrão: listas BLOCOS e SALAS deste comando).",
+        )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Insere tudo com poucas queries por model em uma única transação, sem listar cada registro.",
+        )
+
     def handle(self, *args, **options):
-        self.stdout.write("Inserindo blocos...")
-        blocos_map, blocos_criados = self._inserir_blocos()
+        if options["arquivo"]:
+            layout = carregarLayout(options["arquivo"])
+        else:
+            layout = layoutPadrao()
+
+        if options["bulk"]:
+            blocos_criados, salas_criadas, chaves_criadas = self._inserir_em_lote(layout)
+        else:
+            self.stdout.write("Inserindo blocos...")
+            blocos_map, blocos_criados = self._inserir_blocos(layout)
 
-        self.stdout.write("Inserindo salas...")
-        salas_list, salas_criadas = self._inserir_salas(blocos_map)
+            self.stdout.write("Inserindo salas...")
+            salas_list, salas_criadas = self._inserir_salas(layout, blocos_map)
 
-        self.stdout.write("Inserindo chaves...")
-        chaves_criadas = self._inserir_chaves(salas_list)
+            self.stdout.write("Inserindo chaves...")
+            chaves_criadas = self._inserir_chaves(salas_list)
 
         self.stdout.write(self.style.SUCCESS(
             f"\nConcluído! "
@@ -164,13 +277,69 @@ class Command(BaseCommand):
             f"{chaves_criadas} chave(s) criada(s)."
         ))
 
-    def _inserir_blocos(self):
-        # Retorna dict {indice_1based: objeto_Bloco} e contagem de criados
+    @transaction.atomic
+    def _inserir_em_lote(self, layout):
+        """
+        Para cada model busca de uma vez os registros que já existem e cria os
+        que faltam com um único bulk_create. Os pares bloco/sala e a chave
+        principal de cada sala são comparados em memória.
+        """
+        nomes_blocos = [nome for nome, _ in layout]
+
+        blocos = {
+            bloco.nome: bloco
+            for bloco in Blocos.objects.filter(nome__in=nomes_blocos)
+        }
+        novos_blocos = Blocos.objects.bulk_create(
+            Blocos(nome=nome) for nome in dict.fromkeys(nomes_blocos) if nome not in blocos
+        )
+        blocos.update((bloco.nome, bloco) for bloco in novos_blocos)
+
+        salas = {
+            (sala.bloco_id, sala.nome): sala
+            for sala in Salas.objects.filter(bloco__in=blocos.values())
+        }
+        pares = dict.fromkeys(
+            (blocos[nome_bloco].pk, nome_sala)
+            for nome_bloco, nomes_salas in layout
+            for nome_sala in nomes_salas
+        )
+        novas_salas = Salas.objects.bulk_create(
+            Salas(bloco_id=bloco_id, nome=nome)
+            for bloco_id, nome in pares
+            if (bloco_id, nome) not in salas
+        )
+        salas.update(((sala.bloco_id, sala.nome), sala) for sala in novas_salas)
+
+        salas_do_layout = [salas[par] for par in pares]
+        salas_com_chave = set(
+            Chaves.objects.filter(
+                sala__in=salas_do_layout, principal=True
+            ).values_list("sala_id", flat=True)
+        )
+        novas_chaves = Chaves.objects.bulk_create(
+            Chaves(
+                sala=sala,
+                principal=True,
+                disponivel=True,
+                descricao=f"Chave principal da sala {sala.nome}",
+            )
+            for sala in salas_do_layout
+            if sala.pk not in salas_com_chave
+        )
+
+        # O bulk_create não dispara os signals que atualizam os ETags
+        incrementarVersao("blocos", "salas", "chaves", "catalogo")
+
+        return len(novos_blocos), len(novas_salas), len(novas_chaves)
+
+    def _inserir_blocos(self, layout):
+        # Retorna dict {nome: objeto_Bloco} e contagem de criados
         blocos_map = {}
         criados = 0
-        for idx, dados in enumerate(BLOCOS, start=1):
-            bloco, created = Blocos.objects.get_or_create(nome=dados["nome"])
-            blocos_map[idx] = bloco
+        for nome, _ in layout:
+            bloco, created = Blocos.objects.get_or_create(nome=nome)
+            blocos_map[nome] = bloco
             if created:
                 criados += 1
                 self.stdout.write(f"  [+] Bloco '{bloco.nome}' criado (id={bloco.pk})")
@@ -178,19 +347,20 @@ class Command(BaseCommand):
                 self.stdout.write(f"  [ ] Bloco '{bloco.nome}' já existe (id={bloco.pk})")
         return blocos_map, criados
 
-    def _inserir_salas(self, blocos_map):
+    def _inserir_salas(self, layout, blocos_map):
         # Retorna lista de objetos Sala e contagem de criados
         salas_list = []
         criadas = 0
-        for dados in SALAS:
-            bloco = blocos_map[dados["bloco"]]
-            sala, created = Salas.objects.get_or_create(nome=dados["nome"], bloco=bloco)
-            salas_list.append(sala)
-            if created:
-                criadas += 1
-                self.stdout.write(f"  [+] Sala '{sala.nome}' criada (id={sala.pk})")
-            else:
-                self.stdout.write(f"  [ ] Sala '{sala.nome}' já existe (id={sala.pk})")
+        for nome_bloco, nomes_salas in layout:
+            bloco = blocos_map[nome_bloco]
+            for nome in nomes_salas:
+                sala, created = Salas.objects.get_or_create(nome=nome, bloco=bloco)
+                salas_list.append(sala)
+                if created:
+                    criadas += 1
+                    self.stdout.write(f"  [+] Sala '{sala.nome}' criada (id={sala.pk})")
+                else:
+                    self.stdout.write(f"  [ ] Sala '{sala.nome}' já existe (id={sala.pk})")
         return salas_list, criadas
 
     def _inserir_chaves(self, salas_list):
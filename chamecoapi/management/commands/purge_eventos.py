@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chamecoapi.eventos import purgarEventos
+
+
+class Command(BaseCommand):
+    help = "Remove do banco de dados os eventos de chaves mais antigos que a retenção (eventosRetencao)."
+
+    def handle(self, *args, **options):
+        removidos = purgarEventos()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Concluído! {removidos} evento(s) antigo(s) removido(s)."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chamecoapi.business import purgeExpiredTokens
+
+
+class Command(BaseCommand):
+    help = "Remove do banco de dados os tokens expirados."
+
+    def handle(self, *args, **options):
+        removidos = purgeExpiredTokens()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Concluído! {removidos} token(s) expirado(s) removido(s)."
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0007_auto_20260528_1537'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tokens',
+            name='data_expiracao',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
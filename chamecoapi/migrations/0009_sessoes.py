@@ -0,0 +1,95 @@
+# Generated by Django 5.1 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+SUFIXOS = {
+    "_access": ("access", "expiracao_access"),
+    "_refresh": ("refresh", "expiracao_refresh"),
+    "_id_user": ("id_user", "expiracao_id_user"),
+}
+
+
+def converter_tokens(apps, schema_editor):
+    # Agrupa as linhas "{hash}_access", "{hash}_refresh" e "{hash}_id_user" em uma única sessão
+    Tokens = apps.get_model("chamecoapi", "Tokens")
+    Sessoes = apps.get_model("chamecoapi", "Sessoes")
+
+    sessoes = {}
+
+    for token in Tokens.objects.all().iterator(chunk_size=2000):
+        for sufixo, (campo, campo_expiracao) in SUFIXOS.items():
+            if not token.hash_token.endswith(sufixo):
+                continue
+
+            hash_token = token.hash_token[: -len(sufixo)]
+            sessao = sessoes.setdefault(hash_token, Sessoes(hash_token=hash_token))
+
+            valor = token.valor
+            if campo == "id_user":
+                try:
+                    valor = int(valor)
+                except ValueError:
+                    break
+
+            setattr(sessao, campo, valor)
+            setattr(sessao, campo_expiracao, token.data_expiracao)
+
+            if not sessao.data_expiracao or sessao.data_expiracao < token.data_expiracao:
+                sessao.data_expiracao = token.data_expiracao
+            break
+
+    Sessoes.objects.bulk_create(sessoes.values(), batch_size=1000)
+
+
+def reverter_sessoes(apps, schema_editor):
+    Tokens = apps.get_model("chamecoapi", "Tokens")
+    Sessoes = apps.get_model("chamecoapi", "Sessoes")
+
+    tokens = []
+
+    for sessao in Sessoes.objects.all().iterator(chunk_size=2000):
+        for sufixo, (campo, campo_expiracao) in SUFIXOS.items():
+            valor = getattr(sessao, campo)
+            expiracao = getattr(sessao, campo_expiracao)
+
+            if valor is not None and expiracao:
+                tokens.append(
+                    Tokens(
+                        hash_token=f"{sessao.hash_token}{sufixo}",
+                        valor=str(valor),
+                        data_expiracao=expiracao,
+                    )
+                )
+
+    Tokens.objects.bulk_create(tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0008_alter_tokens_data_expiracao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sessoes',
+            fields=[
+                ('hash_token', models.CharField(max_length=256, primary_key=True, serialize=False)),
+                ('access', models.CharField(max_length=512, null=True)),
+                ('expiracao_access', models.DateTimeField(null=True)),
+                ('refresh', models.CharField(max_length=512, null=True)),
+                ('expiracao_refresh', models.DateTimeField(null=True)),
+                ('id_user', models.IntegerField(null=True)),
+                ('expiracao_id_user', models.DateTimeField(null=True)),
+                ('data_expiracao', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Sessao',
+                'verbose_name_plural': 'Sessoes',
+            },
+        ),
+        migrations.RunPython(converter_tokens, reverter_sessoes),
+        migrations.DeleteModel(
+            name='Tokens',
+        ),
+    ]
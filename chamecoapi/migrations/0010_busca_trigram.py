@@ -0,0 +1,50 @@
+# Generated by Django 5.1 on 2026-10-18 15:45
+
+import chamecoapi.search
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0009_sessoes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # O unaccent é apenas STABLE, por isso não pode ser usado diretamente em índices
+        migrations.RunSQL(
+            """CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS
+            $func$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $func$;
+            """,
+            reverse_sql="DROP FUNCTION IF EXISTS f_unaccent(text);",
+        ),
+        migrations.AddIndex(
+            model_name='blocos',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(chamecoapi.search.FUnaccent('nome')), name='gin_trgm_ops'), name='blocos_nome_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salas',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(chamecoapi.search.FUnaccent('nome')), name='gin_trgm_ops'), name='salas_nome_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuarios',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(chamecoapi.search.FUnaccent('nome')), name='gin_trgm_ops'), name='usuarios_nome_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuarios',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(chamecoapi.search.FUnaccent('tipo')), name='gin_trgm_ops'), name='usuarios_tipo_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuarios',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(chamecoapi.search.FUnaccent('setor')), name='gin_trgm_ops'), name='usuarios_setor_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuariosresponsaveis',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(chamecoapi.search.FUnaccent('nome')), name='gin_trgm_ops'), name='responsaveis_nome_trgm_idx'),
+        ),
+    ]
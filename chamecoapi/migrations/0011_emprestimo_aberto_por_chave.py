@@ -0,0 +1,47 @@
+# Generated by Django 5.1 on 2026-10-18 15:46
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def finalizar_emprestimos_duplicados(apps, schema_editor):
+    # Mantém apenas o empréstimo em aberto mais recente de cada chave. Os mais antigos
+    # são finalizados no horário em que o empréstimo seguinte da chave foi feito.
+    Emprestimos = apps.get_model("chamecoapi", "Emprestimos")
+
+    chaves = (
+        Emprestimos.objects.filter(horario_devolucao__isnull=True)
+        .values("chave")
+        .annotate(abertos=Count("id"))
+        .filter(abertos__gt=1)
+        .values_list("chave", flat=True)
+    )
+
+    for chave in chaves:
+        abertos = list(
+            Emprestimos.objects.filter(chave=chave, horario_devolucao__isnull=True)
+            .order_by("-id")
+        )
+
+        for seguinte, emprestimo in zip(abertos, abertos[1:]):
+            emprestimo.horario_devolucao = seguinte.horario_emprestimo
+            emprestimo.save(update_fields=["horario_devolucao"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0010_busca_trigram'),
+    ]
+
+    operations = [
+        migrations.RunPython(finalizar_emprestimos_duplicados, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='emprestimos',
+            index=models.Index(condition=models.Q(('horario_devolucao__isnull', True)), fields=['-id'], name='emprestimos_abertos_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='emprestimos',
+            constraint=models.UniqueConstraint(condition=models.Q(('horario_devolucao__isnull', True)), fields=('chave',), name='emprestimo_aberto_por_chave'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0011_emprestimo_aberto_por_chave'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emprestimos',
+            index=models.Index(fields=['horario_emprestimo', 'id'], name='emprestimos_horario_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emprestimos',
+            index=models.Index(fields=['usuario_solicitante', 'horario_emprestimo'], name='emprestimos_solicitante_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emprestimos',
+            index=models.Index(fields=['chave', 'horario_emprestimo'], name='emprestimos_chave_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 15:54
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remover_autorizacoes_duplicadas(apps, schema_editor):
+    # Mantém apenas a autorização mais antiga de cada par usuário/sala
+    PessoasAutorizadas = apps.get_model("chamecoapi", "PessoasAutorizadas")
+
+    duplicadas = (
+        PessoasAutorizadas.objects.values("usuario", "sala")
+        .annotate(total=Count("id"), primeira=Min("id"))
+        .filter(total__gt=1)
+    )
+
+    for par in duplicadas:
+        PessoasAutorizadas.objects.filter(
+            usuario=par["usuario"], sala=par["sala"]
+        ).exclude(pk=par["primeira"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0012_emprestimos_indices_periodo'),
+    ]
+
+    operations = [
+        migrations.RunPython(remover_autorizacoes_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pessoasautorizadas',
+            constraint=models.UniqueConstraint(fields=('usuario', 'sala'), name='pessoa_autorizada_por_sala'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-18 15:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0013_pessoa_autorizada_por_sala'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pessoasautorizadas',
+            name='usuario',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='chamecoapi.usuarios'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0014_pessoas_autorizadas_sem_indice_usuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventosChaves',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('chave', models.IntegerField()),
+                ('tipo', models.CharField(max_length=16)),
+                ('disponivel', models.BooleanField(null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'EventoChave',
+                'verbose_name_plural': 'EventosChaves',
+                'ordering': ['id'],
+            },
+        ),
+    ]
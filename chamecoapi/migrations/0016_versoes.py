@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0015_eventos_chaves'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Versoes',
+            fields=[
+                ('nome', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('versao', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Versao',
+                'verbose_name_plural': 'Versoes',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-18 16:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def preencher_emprestimo_atual(apps, schema_editor):
+    # Aponta cada chave para o seu empréstimo em aberto, se houver
+    Chaves = apps.get_model("chamecoapi", "Chaves")
+    Emprestimos = apps.get_model("chamecoapi", "Emprestimos")
+
+    aberto = Emprestimos.objects.filter(
+        chave=OuterRef("pk"), horario_devolucao__isnull=True
+    ).order_by()
+
+    Chaves.objects.update(emprestimo_atual=Subquery(aberto.values("id")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamecoapi', '0016_versoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chaves',
+            name='emprestimo_atual',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chamecoapi.emprestimos'),
+        ),
+        migrations.RunPython(preencher_emprestimo_atual, migrations.RunPython.noop),
+    ]
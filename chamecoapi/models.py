@@ -1,10 +1,28 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
 
+from .search import textoBusca
 
-class Tokens(models.Model):
+
+def indiceTrigram(campo: str, nome: str) -> GinIndex:
+    # Índice usado pelas buscas de search.filtrarTexto
+    return GinIndex(OpClass(textoBusca(campo), name="gin_trgm_ops"), name=nome)
+
+
+class Sessoes(models.Model):
     hash_token = models.CharField(primary_key=True, max_length=256, null=False)
-    valor = models.CharField(max_length=512, null=False)
-    data_expiracao = models.DateTimeField(null=False)
+    access = models.CharField(max_length=512, null=True)
+    expiracao_access = models.DateTimeField(null=True)
+    refresh = models.CharField(max_length=512, null=True)
+    expiracao_refresh = models.DateTimeField(null=True)
+    id_user = models.IntegerField(null=True)
+    expiracao_id_user = models.DateTimeField(null=True)
+    # Maior das expirações acima, usada na limpeza dos registros expirados
+    data_expiracao = models.DateTimeField(null=False, db_index=True)
+
+    class Meta:
+        verbose_name = "Sessao"
+        verbose_name_plural = "Sessoes"
 
 
 class Usuarios(models.Model):
@@ -22,6 +40,11 @@ class Usuarios(models.Model):
         verbose_name = "Usuario"
         verbose_name_plural = "Usuarios"
         ordering = ["id"]
+        indexes = [
+            indiceTrigram("nome", "usuarios_nome_trgm_idx"),
+            indiceTrigram("tipo", "usuarios_tipo_trgm_idx"),
+            indiceTrigram("setor", "usuarios_setor_trgm_idx"),
+        ]
 
     def __str__(self) -> str:
         str = f"{self.nome}"
@@ -35,6 +58,7 @@ class Blocos(models.Model):
         verbose_name = "Bloco"
         verbose_name_plural = "Blocos"
         ordering = ["nome"]
+        indexes = [indiceTrigram("nome", "blocos_nome_trgm_idx")]
 
     def __str__(self) -> str:
         str = f"{self.nome}"
@@ -54,6 +78,7 @@ class Salas(models.Model):
         verbose_name = "Sala"
         verbose_name_plural = "Salas"
         ordering = ["nome"]
+        indexes = [indiceTrigram("nome", "salas_nome_trgm_idx")]
 
     def __str__(self) -> str:
         str = f"{self.nome}"
@@ -71,6 +96,15 @@ class Chaves(models.Model):
         null=True,
         blank=True,
     )
+    # Empréstimo em aberto da chave, mantido pelas views de empréstimo na mesma
+    # transação que altera "disponivel"
+    emprestimo_atual = models.ForeignKey(
+        "Emprestimos",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = "Chave"
@@ -90,6 +124,8 @@ class PessoasAutorizadas(models.Model):
         Usuarios,
         on_delete=models.CASCADE,
         null=False,
+        # Coberto pelo índice da constraint única (usuario, sala)
+        db_index=False,
     )
     sala = models.ForeignKey(
         Salas,
@@ -97,6 +133,16 @@ class PessoasAutorizadas(models.Model):
         null=False,
     )
 
+    class Meta:
+        constraints = [
+            # Permite adicionar autorizações em lote com bulk_create(ignore_conflicts=True)
+            # e torna a verificação de autorização uma única busca no índice
+            models.UniqueConstraint(
+                fields=["usuario", "sala"],
+                name="pessoa_autorizada_por_sala",
+            ),
+        ]
+
     def __str__(self) -> str:
         str = f"Usuario: {self.usuario}, chave: {self.chave}"
         return str
@@ -133,6 +179,35 @@ class Emprestimos(models.Model):
         verbose_name = "Emprestimo"
         verbose_name_plural = "Emprestimos"
         ordering = ["-id"]
+        constraints = [
+            # Uma chave só pode ter um empréstimo em aberto por vez
+            models.UniqueConstraint(
+                fields=["chave"],
+                condition=models.Q(horario_devolucao__isnull=True),
+                name="emprestimo_aberto_por_chave",
+            ),
+        ]
+        indexes = [
+            # Atende a listagem de empréstimos em aberto (finalizados=false)
+            models.Index(
+                fields=["-id"],
+                condition=models.Q(horario_devolucao__isnull=True),
+                name="emprestimos_abertos_idx",
+            ),
+            # Relatórios por período e filtros por pessoa ou chave em um período
+            models.Index(
+                fields=["horario_emprestimo", "id"],
+                name="emprestimos_horario_idx",
+            ),
+            models.Index(
+                fields=["usuario_solicitante", "horario_emprestimo"],
+                name="emprestimos_solicitante_idx",
+            ),
+            models.Index(
+                fields=["chave", "horario_emprestimo"],
+                name="emprestimos_chave_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         str = f"Horario: {self.horario_emprestimo}, chave: {self.chave}"
@@ -152,7 +227,40 @@ class UsuariosResponsaveis(models.Model):
         verbose_name = "Usuario Responsável"
         verbose_name_plural = "Usuarios Responsaveis"
         ordering = ["nome"]
+        indexes = [indiceTrigram("nome", "responsaveis_nome_trgm_idx")]
 
     def __str__(self) -> str:
         str = f"{self.nome}"
         return str
+
+
+class EventosChaves(models.Model):
+    # O id crescente é a sequência usada no "Last-Event-ID" do stream de eventos
+    id = models.BigAutoField(primary_key=True)
+    chave = models.IntegerField(null=False)
+    tipo = models.CharField(max_length=16, null=False)
+    disponivel = models.BooleanField(null=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "EventoChave"
+        verbose_name_plural = "EventosChaves"
+        ordering = ["id"]
+
+    def __str__(self) -> str:
+        str = f"Evento {self.id}: {self.tipo} da chave {self.chave}"
+        return str
+
+
+class Versoes(models.Model):
+    # Contador de alterações de cada conjunto de dados, usado nos ETags das listagens
+    nome = models.CharField(primary_key=True, max_length=64)
+    versao = models.BigIntegerField(default=0, null=False)
+
+    class Meta:
+        verbose_name = "Versao"
+        verbose_name_plural = "Versoes"
+
+    def __str__(self) -> str:
+        str = f"{self.nome}: {self.versao}"
+        return str
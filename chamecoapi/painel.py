@@ -0,0 +1,93 @@
+import os
+
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .cache import TTLCache
+from .models import Chaves
+
+load_dotenv()
+
+# Dados que aparecem no painel; qualquer escrita neles gera um novo painel
+PAINEL_VERSOES = ("blocos", "salas", "chaves", "emprestimos", "usuarios", "responsaveis")
+
+# Tempo máximo, em segundos, que um painel montado fica guardado por worker
+PAINEL_CACHE_TTL = int(os.environ.get("painelCacheTTL", 300))
+
+paineis = TTLCache(max_size=4)
+
+
+def montarPainel() -> list[dict]:
+    """
+    Monta o painel de chaves (blocos > salas > chaves, com o empréstimo em
+    aberto de cada chave) com uma única query: o empréstimo vem da junção
+    com "emprestimo_atual", sem procurar o empréstimo em aberto de cada chave.
+    """
+    chaves = Chaves.objects.values(
+        "id",
+        "descricao",
+        "principal",
+        "disponivel",
+        "sala_id",
+        "sala__nome",
+        "sala__bloco_id",
+        "sala__bloco__nome",
+        "emprestimo_atual_id",
+        "emprestimo_atual__horario_emprestimo",
+        "emprestimo_atual__usuario_solicitante_id",
+        "emprestimo_atual__usuario_solicitante__nome",
+        "emprestimo_atual__usuario_responsavel_id",
+        "emprestimo_atual__usuario_responsavel__nome",
+    ).order_by("sala__bloco__nome", "sala__bloco_id", "sala__nome", "sala_id", "id")
+
+    blocos = []
+    bloco = sala = None
+
+    for chave in chaves:
+        if not bloco or bloco["id"] != chave["sala__bloco_id"]:
+            bloco = {"id": chave["sala__bloco_id"], "nome": chave["sala__bloco__nome"], "salas": []}
+            blocos.append(bloco)
+            sala = None
+
+        if not sala or sala["id"] != chave["sala_id"]:
+            sala = {"id": chave["sala_id"], "nome": chave["sala__nome"], "chaves": []}
+            bloco["salas"].append(sala)
+
+        emprestimo = None
+
+        if chave["emprestimo_atual_id"]:
+            emprestimo = {
+                "id": chave["emprestimo_atual_id"],
+                "horario_emprestimo": timezone.localtime(
+                    chave["emprestimo_atual__horario_emprestimo"]
+                ).isoformat(),
+                "usuario_solicitante": {
+                    "id": chave["emprestimo_atual__usuario_solicitante_id"],
+                    "nome": chave["emprestimo_atual__usuario_solicitante__nome"],
+                },
+                "usuario_responsavel": {
+                    "id": chave["emprestimo_atual__usuario_responsavel_id"],
+                    "nome": chave["emprestimo_atual__usuario_responsavel__nome"],
+                },
+            }
+
+        sala["chaves"].append({
+            "id": chave["id"],
+            "descricao": chave["descricao"],
+            "principal": chave["principal"],
+            "disponivel": chave["disponivel"],
+            "emprestimo": emprestimo,
+        })
+
+    return blocos
+
+
+def obterPainel(versoes: tuple[int, ...]) -> list[dict]:
+    # O painel só é montado de novo quando alguma das versões muda
+    painel = paineis.get(versoes)
+
+    if painel is None:
+        painel = montarPainel()
+        paineis.set(versoes, painel, PAINEL_CACHE_TTL)
+
+    return painel
@@ -1,17 +1,55 @@
-import os
+import unicodedata
+from functools import lru_cache
+from typing import Iterable
 
 from django.contrib.auth.models import AnonymousUser
-from dotenv import load_dotenv
 from rest_framework import permissions
 from rest_framework.exceptions import PermissionDenied
 
-from .business import getIdUser, isTokenValid, requestFactory
+from .business import getCortexUser, getIdUser, isTokenValid
 from .bases import (
-    tipos_usa_sistema_livremente, setores_usa_sistema_livremente, tipos_admin, setores_admin
+    tipos_usa_sistema_livremente, setores_usa_sistema_livremente, tipos_admin, setores_admin,
+    tipos_login, setores_login,
 )
 
-load_dotenv()
-URL_BASE = os.environ.get("urlBase")
+
+def normalizar(valor: str | None) -> str:
+    # Remove acentos, espaços nas pontas e deixa em minúsculas
+    valor = unicodedata.normalize("NFKD", valor or "")
+
+    return "".join(c for c in valor if not unicodedata.combining(c)).strip().lower()
+
+
+class PermissionPolicy:
+    """
+    Conjunto de tipos e setores que liberam uma ação, normalizados uma única vez.
+    A decisão para cada combinação (tipo, setores) fica memorizada.
+    """
+
+    def __init__(self, tipos: Iterable[str], setores: Iterable[str], cache_size: int = 1024):
+        self.tipos = frozenset(normalizar(tipo) for tipo in tipos)
+        self.setores = frozenset(normalizar(setor) for setor in setores)
+        self._decidir = lru_cache(maxsize=cache_size)(self._calcular)
+
+    def _calcular(self, tipo: str, setores: tuple[str, ...]) -> bool:
+        if normalizar(tipo) in self.tipos:
+            return True
+
+        return any(normalizar(setor) in self.setores for setor in setores)
+
+    def permite(self, tipo: str | None, setores: Iterable[str] | str | None) -> bool:
+        # Os setores vêm como lista do Cortex, ou separados por vírgula no model Usuarios
+        if isinstance(setores, str):
+            setores = setores.split(",")
+
+        return self._decidir(tipo or "", tuple(setores or ()))
+
+
+politica_admin = PermissionPolicy(tipos_admin, setores_admin)
+politica_login = PermissionPolicy(tipos_login, setores_login)
+politica_uso_livre = PermissionPolicy(
+    tipos_usa_sistema_livremente, setores_usa_sistema_livremente
+)
 
 
 class IsUserAuthenticated(permissions.BasePermission):
@@ -54,31 +92,22 @@ class IsAdmin(permissions.BasePermission):
 
             hash_token = serializer["token"]
 
+        return self._permiteToken(hash_token, default_use)
+
+    def _permiteToken(self, hash_token, default_use=True):
         id_user = getIdUser(hash_token)
 
         if not id_user:
             raise PermissionDenied(detail="É necessário autenticação.")
 
-        url_get_user = f"{URL_BASE}cortex/api/gerusuarios/v1/users/{id_user}"
-
-        response = requestFactory("get", url_get_user, hash_token)
+        usuario = getCortexUser(id_user, hash_token)
 
-        if not response:
+        if not usuario:
             raise PermissionDenied(detail="Usuário não encontrado.")
 
-        tipos_permitidos = tipos_admin
-
-        if response.json()["nome_tipo"] in tipos_permitidos:
+        if politica_admin.permite(usuario["nome_tipo"], usuario["nome_setores"]):
             return True
 
-        setores_permitidos = setores_admin
-
-        setores_usuario = response.json()["nome_setores"]
-
-        for setor in setores_permitidos:
-            if setor.lower() in setores_usuario:
-                return True
-
         if default_use:
             raise PermissionDenied(
                 detail="O tipo de usuário não permite executar esta ação."
@@ -87,38 +116,32 @@ class IsAdmin(permissions.BasePermission):
             return False
 
 
+class IsAdminByToken(IsAdmin):
+    """
+    Verifica apenas o tipo do usuário, com o token do corpo da requisição, e
+    deixa a validação dos dados para a view, que não precisa repeti-la.
+    """
+
+    def has_permission(self, request, view, default_use=True):
+        dados = request.data if isinstance(request.data, dict) else {}
+
+        return self._permiteToken(dados.get("token"), default_use)
+
+
 class CanLogIn(permissions.BasePermission):
 
     def has_permission(self, request, view, hash_token):
         try:
             id_user = getIdUser(hash_token)
 
-            url_get_user = f"{URL_BASE}cortex/api/gerusuarios/v1/users/{id_user}"
+            usuario = getCortexUser(id_user, hash_token)
 
-            response = requestFactory("get", url_get_user, hash_token)
-
-            if not response:
+            if not usuario:
                 raise PermissionDenied(detail="Usuário não encontrado.")
 
-            tipos_permitidos = [
-                "admin", "ti", "coordenador", "aluno", "Serv.Terceirizado", "professor", "tec.administrativo", "Engenheiro",
-                "enfermeiro", "engenheiro", "medico", "nutricionista", "odontologo", "pedagogo", "psicologo", "vigilante"
-            ]
-
-            if response.json()["nome_tipo"] in tipos_permitidos:
-                return True
-
-            setores_permitidos = [
-                "TI", "Guarita", "Coordenacao de Disciplina", 'direcao geral', 'direcao de ensino', "VIGILANTE", "limpeza", "aux. cozinha"
-            ]
-
-            setores_usuario = response.json()["nome_setores"]
-
-            for setor in setores_permitidos:
-                if setor.lower() in setores_usuario:
-                    return True
-
-            return False
+            return politica_login.permite(
+                usuario["nome_tipo"], usuario["nome_setores"]
+            )
         except Exception as e:
             print(e)
             return False
@@ -139,25 +162,13 @@ class CanUseSystem(permissions.BasePermission):
         if not id_user:
             raise PermissionDenied(detail="É necessário autenticação.")
 
-        url_get_user = f"{URL_BASE}cortex/api/gerusuarios/v1/users/{id_user}"
-
-        response = requestFactory("get", url_get_user, hash_token)
+        usuario = getCortexUser(id_user, hash_token)
 
-        if not response:
+        if not usuario:
             raise PermissionDenied(detail="Usuário não encontrado.")
 
-        tipos_permitidos = tipos_usa_sistema_livremente
-
-        if response.json()["nome_tipo"] in tipos_permitidos:
+        if politica_uso_livre.permite(usuario["nome_tipo"], usuario["nome_setores"]):
             return True
 
-        setores_permitidos = setores_usa_sistema_livremente
-
-        setores_usuario = response.json()["nome_setores"]
-
-        for setor in setores_permitidos:
-            if setor.lower() in setores_usuario:
-                return True
-
         raise PermissionDenied(
             detail="Usuário sem permissão para executar esta ação.")
@@ -0,0 +1,29 @@
+from django.db.models import CharField, Func, QuerySet, Value
+from django.db.models.functions import Upper
+
+
+class FUnaccent(Func):
+    """
+    Versão IMMUTABLE do unaccent, criada na migration 0010_busca_trigram, que
+    pode ser usada nos índices GIN com pg_trgm.
+    """
+
+    function = "f_unaccent"
+    output_field = CharField()
+
+
+def textoBusca(expressao) -> Upper:
+    # Mesma expressão dos índices trigram: UPPER(f_unaccent(campo))
+    return Upper(FUnaccent(expressao))
+
+
+def filtrarTexto(queryset: QuerySet, campo: str, valor: str) -> QuerySet:
+    """
+    Equivalente a "campo__unaccent__icontains=valor", mas escrito de forma que o
+    PostgreSQL consiga usar os índices trigram declarados nos models.
+    """
+    alias = f"busca_{campo.replace('__', '_')}"
+
+    return queryset.alias(**{alias: textoBusca(campo)}).filter(
+        **{f"{alias}__contains": textoBusca(Value(valor))}
+    )
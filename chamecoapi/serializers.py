@@ -9,7 +9,6 @@ from .models import (
     Blocos,
     Chaves,
     Emprestimos,
-    PessoasAutorizadas,
     Salas,
     Usuarios,
     UsuariosResponsaveis,
@@ -85,7 +84,8 @@ class UsuariosSerializer(serializers.ModelSerializer):
     def get_salas(self, obj):
         data = []
 
-        queryset = PessoasAutorizadas.objects.filter(usuario=obj)
+        # Consome o prefetch feito pela view, quando houver
+        queryset = obj.pessoasautorizadas_set.all()
 
         for autorizacao in queryset:
             aux = {}
@@ -138,7 +138,8 @@ class SalasSerializer(serializers.ModelSerializer):
     def get_usuarios(self, obj):
         data = []
 
-        queryset = PessoasAutorizadas.objects.filter(sala=obj)
+        # Consome o prefetch feito pela view, quando houver
+        queryset = obj.pessoasautorizadas_set.all()
 
         for autorizacao in queryset:
             aux = {}
@@ -157,9 +158,12 @@ class ChavesSerializer(serializers.ModelSerializer):
             "sala",
             "nome_sala",
             "disponivel",
+            "emprestimo_atual",
             "descricao",
             "token",
         ]
+        # Alterado apenas pelas views de empréstimo
+        read_only_fields = ["emprestimo_atual"]
 
     token = serializers.CharField(write_only=True, required=True)
     # Especeficação de que o campo "sala" é um uma chave primária relacionada ao Model Salas
@@ -174,6 +178,39 @@ class AutorizadosSerializer(serializers.Serializer):
     nome = serializers.CharField(read_only=True)
 
 
+class AutorizadosSalaSerializer(serializers.Serializer):
+    operacao = serializers.ChoiceField(
+        choices=["adicionar", "remover", "substituir"], write_only=True
+    )
+    usuarios = serializers.ListField(
+        child=serializers.IntegerField(), write_only=True, max_length=1000
+    )
+    token = serializers.CharField(write_only=True, required=True)
+
+    def validate_usuarios(self, value):
+        ids = set(value)
+        existentes = set(
+            Usuarios.objects.filter(pk__in=ids).values_list("id", flat=True)
+        )
+        inexistentes = sorted(ids - existentes)
+
+        if inexistentes:
+            raise serializers.ValidationError(
+                f"Usuários não encontrados: {', '.join(map(str, inexistentes))}."
+            )
+
+        return sorted(ids)
+
+    def validate(self, attrs):
+        # Só a substituição pode receber a lista vazia (remove todos)
+        if not attrs["usuarios"] and attrs["operacao"] != "substituir":
+            raise serializers.ValidationError(
+                {"usuarios": "Informe ao menos um usuário."}
+            )
+
+        return attrs
+
+
 class UsuariosResponsaveisSerializer(serializers.ModelSerializer):
     class Meta:
         model = UsuariosResponsaveis
@@ -223,13 +260,86 @@ class RealizarEmprestimoSerializer(serializers.Serializer):
     observacao = serializers.CharField(write_only=True, required=False)
 
 
+class ItemEmprestimoLoteSerializer(serializers.Serializer):
+    chave = serializers.IntegerField(write_only=True)
+    usuario_responsavel = serializers.IntegerField(write_only=True)
+    usuario_solicitante = serializers.IntegerField(write_only=True)
+    observacao = serializers.CharField(write_only=True, required=False)
+
+
+class RealizarEmprestimoLoteSerializer(serializers.Serializer):
+    emprestimos = ItemEmprestimoLoteSerializer(
+        many=True, write_only=True, allow_empty=False, max_length=100
+    )
+    token = serializers.CharField(write_only=True, required=True)
+
+
 class FinalizarEmprestimoSerializer(serializers.Serializer):
     id_emprestimo = serializers.IntegerField(write_only=True)
     token = serializers.CharField(write_only=True, required=True)
 
 
+class FinalizarEmprestimoLoteSerializer(serializers.Serializer):
+    ids_emprestimos = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        allow_empty=False,
+        max_length=100,
+    )
+    token = serializers.CharField(write_only=True, required=True)
+
+
 class TrocarEmprestimoSerializer(serializers.Serializer):
     id_emprestimo = serializers.IntegerField(write_only=True)
     novo_solicitante = serializers.IntegerField(write_only=True)
     novo_responsavel = serializers.IntegerField(write_only=True)
     token = serializers.CharField(write_only=True, required=True)
+
+
+# Serializers usados apenas para documentar o formato do painel de chaves,
+# que é montado diretamente em painel.montarPainel
+class EmprestimoPainelSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    horario_emprestimo = serializers.DateTimeField()
+    usuario_solicitante = RetornoDeSalasEUsuariosSerializer(allow_null=True)
+    usuario_responsavel = RetornoDeSalasEUsuariosSerializer(allow_null=True)
+
+
+class ChavePainelSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    descricao = serializers.CharField(allow_null=True)
+    principal = serializers.BooleanField()
+    disponivel = serializers.BooleanField()
+    emprestimo = EmprestimoPainelSerializer(allow_null=True)
+
+
+class SalaPainelSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    nome = serializers.CharField()
+    chaves = ChavePainelSerializer(many=True)
+
+
+class BlocoPainelSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    nome = serializers.CharField()
+    salas = SalaPainelSerializer(many=True)
+
+
+# Serializers usados apenas para documentar o formato da árvore do campus,
+# que é serializada diretamente em catalogo.serializarArvore
+class ChaveCampusSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    descricao = serializers.CharField(allow_null=True)
+    principal = serializers.BooleanField()
+
+
+class SalaCampusSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    nome = serializers.CharField()
+    chaves = ChaveCampusSerializer(many=True)
+
+
+class BlocoCampusSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    nome = serializers.CharField()
+    salas = SalaCampusSerializer(many=True)
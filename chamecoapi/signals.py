@@ -0,0 +1,54 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .catalogo import CAMPOS_EMPRESTIMO, invalidarCatalogo
+from .models import (
+    Blocos,
+    Chaves,
+    Emprestimos,
+    PessoasAutorizadas,
+    Salas,
+    Usuarios,
+    UsuariosResponsaveis,
+)
+from .versoes import incrementarVersao
+
+# Nome do contador de versão de cada model. Operações em lote (bulk_create,
+# bulk_update e QuerySet.update) não disparam signals e incrementam a versão
+# explicitamente.
+VERSOES_MODELS = {
+    Blocos: "blocos",
+    Salas: "salas",
+    Chaves: "chaves",
+    UsuariosResponsaveis: "responsaveis",
+    Usuarios: "usuarios",
+    PessoasAutorizadas: "autorizacoes",
+    Emprestimos: "emprestimos",
+}
+
+
+# Models que formam a árvore do campus (catalogo.py)
+CATALOGO_MODELS = (Blocos, Salas, Chaves)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def incrementarVersaoDoModel(sender, update_fields=None, **kwargs):
+    nome = VERSOES_MODELS.get(sender)
+
+    if not nome:
+        return
+
+    # Os empréstimos salvam só disponivel/emprestimo_atual, que não estão no catálogo
+    if sender in CATALOGO_MODELS and not (update_fields and update_fields <= CAMPOS_EMPRESTIMO):
+        incrementarVersao(nome, "catalogo")
+        invalidarCatalogo()
+    else:
+        incrementarVersao(nome)
+
+
+@receiver(m2m_changed, sender=PessoasAutorizadas)
+def incrementarVersaoDasAutorizacoes(sender, action, **kwargs):
+    # Usuarios.salas_autorizadas.set(...) e Salas.usuarios_autorizados.set(...)
+    if action in ("post_add", "post_remove", "post_clear"):
+        incrementarVersao("autorizacoes")
@@ -1,18 +1,56 @@
-from datetime import timedelta
-from unittest.mock import patch
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest.mock import MagicMock, patch
 
+import jwt
+from asgiref.sync import async_to_sync
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from rest_framework.test import APITestCase
+from openpyxl import Workbook, load_workbook
+from rest_framework.test import APITestCase, APITransactionTestCase
 
+from .business import (
+	cortex_users,
+	getCortexUser,
+	getTokens,
+	invalidateCortexUser,
+	isTokenValid,
+	setIdUser,
+	setTokens,
+	verified_tokens,
+)
+from .catalogo import catalogo
+from .eventos import (
+	LeitorEventos,
+	distribuidor,
+	purgarEventos,
+	registrarEventoChave,
+	semConexao,
+)
 from .models import (
 	Blocos,
 	Chaves,
 	Emprestimos,
+	EventosChaves,
 	PessoasAutorizadas,
 	Salas,
+	Sessoes,
 	Usuarios,
 	UsuariosResponsaveis,
 )
+from .painel import paineis
+from .permissions import PermissionPolicy, politica_admin
+from .versoes import incrementarVersao, periodoVersoes
+from .views import EstimatedCountPaginator
 
 
 class ViewSetGetAndRetrieveTests(APITestCase):
@@ -297,3 +335,1010 @@ class ViewSetGetAndRetrieveTests(APITestCase):
 		self.assertEqual(
 			response.data["usuario_responsavel"], self.responsavel_academico.id,
 		)
+
+
+class TokenCacheTests(APITestCase):
+	def setUp(self):
+		verified_tokens.clear()
+		cortex_users.clear()
+		self.addCleanup(verified_tokens.clear)
+		self.addCleanup(cortex_users.clear)
+
+	def _access(self, expira_em):
+		return jwt.encode(
+			{"user_id": 1, "exp": int(time.time() + expira_em)},
+			"segredo",
+			algorithm="HS256",
+		)
+
+	@patch("chamecoapi.business.cortexRequest")
+	def test_verificacao_reaproveitada_ate_o_exp(self, mocked_post):
+		mocked_post.return_value = MagicMock(status_code=200)
+		setTokens("hash-teste", self._access(3600), "refresh")
+		# Simula outro worker, que ainda não verificou o token
+		verified_tokens.clear()
+
+		for _ in range(3):
+			self.assertTrue(isTokenValid("hash-teste"))
+
+		self.assertEqual(mocked_post.call_count, 1)
+
+	@patch("chamecoapi.business.cortexRequest")
+	def test_token_perto_de_expirar_nao_e_guardado(self, mocked_post):
+		mocked_post.return_value = MagicMock(status_code=200)
+		setTokens("hash-teste", self._access(5), "refresh")
+
+		self.assertTrue(isTokenValid("hash-teste"))
+		self.assertTrue(isTokenValid("hash-teste"))
+
+		self.assertEqual(mocked_post.call_count, 2)
+
+	def test_tokens_expirados_ignorados_e_removidos_pelo_purge(self):
+		setTokens("hash-teste", self._access(3600), "refresh")
+		Sessoes.objects.filter(hash_token="hash-teste").update(
+			expiracao_access=timezone.now() - timedelta(minutes=1),
+		)
+
+		self.assertEqual(
+			getTokens("hash-teste"), {"access": None, "refresh": "refresh"},
+		)
+
+		Sessoes.objects.filter(hash_token="hash-teste").update(
+			data_expiracao=timezone.now() - timedelta(minutes=1),
+		)
+
+		self.assertIsNone(getTokens("hash-teste"))
+		self.assertEqual(Sessoes.objects.count(), 1)
+
+		call_command("purge_tokens", stdout=MagicMock())
+
+		self.assertFalse(Sessoes.objects.exists())
+
+	@patch("chamecoapi.business.cortexRequest")
+	def test_perfil_do_cortex_reaproveitado_entre_permissoes(self, mocked_request):
+		perfil = {"id": 7, "nome_tipo": "professor", "nome_setores": ["ti"]}
+		mocked_request.return_value = MagicMock(
+			status_code=200, ok=True, json=MagicMock(return_value=perfil),
+		)
+		setTokens("hash-teste", self._access(3600), "refresh")
+		setIdUser("hash-teste", 7)
+
+		for _ in range(3):
+			self.assertEqual(getCortexUser(7, "hash-teste"), perfil)
+
+		self.assertEqual(mocked_request.call_count, 1)
+
+		invalidateCortexUser(7)
+		getCortexUser(7, "hash-teste")
+
+		self.assertEqual(mocked_request.call_count, 2)
+
+
+class PermissionPolicyTests(SimpleTestCase):
+	def test_tipos_e_setores_sem_acento_e_caixa(self):
+		politica = PermissionPolicy(["Professor"], ["coordenacao de patrimônio e almoxarifado"])
+
+		self.assertTrue(politica.permite("PROFESSOR", []))
+		self.assertTrue(politica.permite("aluno", ["Coordenação de Patrimonio e Almoxarifado"]))
+		self.assertTrue(politica.permite("aluno", "ti, Coordenação de Patrimônio e Almoxarifado"))
+		self.assertFalse(politica.permite("aluno", "ti, guarita"))
+		self.assertFalse(politica.permite(None, None))
+
+
+class ImportarUsuariosTests(SimpleTestCase):
+	def setUp(self):
+		self.pasta = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.pasta)
+
+		planilhas = {
+			"alunos": [("CPF", "Matrícula"), ("111.111.111-11", "ABC1"), ("222.222.222-22", "ABC2")],
+			"terceirizados": [("CPF",), (33333333333,), (None,)],
+		}
+
+		for tipo, linhas in planilhas.items():
+			workbook = Workbook()
+			for linha in linhas:
+				workbook.active.append(linha)
+			workbook.save(os.path.join(self.pasta, f"{tipo}.xlsx"))
+
+	def _importar(self, status_por_cpf):
+		def post(url, json, timeout):
+			return MagicMock(
+				status_code=status_por_cpf.get(json["cpf"], 200),
+				json=lambda: {"nome": json["cpf"], "usuario": 1},
+				text="erro",
+			)
+
+		with patch("requests.Session.post", side_effect=post) as mocked_post:
+			call_command(
+				"importar_usuarios", pasta=self.pasta, workers=2,
+				stdout=StringIO(), stderr=StringIO(),
+			)
+
+		return sorted(
+			(call.kwargs["json"]["cpf"], call.kwargs["json"]["password"])
+			for call in mocked_post.call_args_list
+		)
+
+	def test_pasta_inexistente(self):
+		with self.assertRaisesMessage(CommandError, "não encontrada"):
+			call_command(
+				"importar_usuarios", pasta=os.path.join(self.pasta, "inexistente"),
+				stdout=StringIO(), stderr=StringIO(),
+			)
+
+	def test_importa_em_paralelo_e_retoma_do_checkpoint(self):
+		chamadas = self._importar({"22222222222": 401})
+		self.assertEqual(
+			chamadas,
+			[("11111111111", "abc1"), ("22222222222", "abc2"), ("33333333333", "33333333333")],
+		)
+
+		# Só a falha é refeita na próxima execução
+		chamadas = self._importar({})
+		self.assertEqual(chamadas, [("22222222222", "abc2")])
+
+		self.assertEqual(self._importar({}), [])
+
+	def test_resposta_sem_json_entra_no_relatorio(self):
+		def post(url, json, timeout):
+			resposta = MagicMock(status_code=200)
+			resposta.json.side_effect = ValueError("corpo inválido")
+			return resposta
+
+		stdout = StringIO()
+
+		with patch("requests.Session.post", side_effect=post):
+			call_command(
+				"importar_usuarios", pasta=self.pasta, tipos=["terceirizados"],
+				stdout=stdout, stderr=StringIO(),
+			)
+
+		self.assertIn("1 falha(s)", stdout.getvalue())
+		self.assertIn("ValueError: corpo inválido", stdout.getvalue())
+
+		# Não foi marcado como importado, então é refeito na próxima execução
+		self.assertIn(("33333333333", "33333333333"), self._importar({}))
+
+
+class PopulateDataTests(APITestCase):
+	def _arquivo(self, nome, conteudo):
+		pasta = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, pasta)
+		caminho = os.path.join(pasta, nome)
+
+		with open(caminho, "w", encoding="utf-8") as arquivo:
+			arquivo.write(conteudo)
+
+		return caminho
+
+	def test_bulk_com_layout_do_arquivo(self):
+		Blocos.objects.create(nome="Bloco X")
+		caminho = self._arquivo(
+			"campus.yaml",
+			"blocos:\n"
+			"  - nome: Bloco X\n"
+			"    salas: [X01 / Sala 1, X02 / Sala 2]\n"
+			"  - nome: Bloco Y\n"
+			"    salas:\n"
+			"      - nome: Y01 / Sala 1\n",
+		)
+
+		# 3 buscas + 3 inserções + versões dos ETags (após a confirmação), mais o savepoint da transação
+		with self.assertNumQueries(9), self.captureOnCommitCallbacks(execute=True):
+			call_command("populate_data", bulk=True, arquivo=caminho, stdout=StringIO())
+
+		self.assertEqual(Blocos.objects.count(), 2)
+		self.assertEqual(
+			sorted(Salas.objects.values_list("bloco__nome", "nome")),
+			[("Bloco X", "X01 / Sala 1"), ("Bloco X", "X02 / Sala 2"), ("Bloco Y", "Y01 / Sala 1")],
+		)
+		self.assertEqual(Chaves.objects.filter(principal=True).count(), 3)
+
+		saida = StringIO()
+		call_command("populate_data", bulk=True, arquivo=caminho, stdout=saida)
+		self.assertIn("0 bloco(s) criado(s), 0 sala(s) criada(s), 0 chave(s)", saida.getvalue())
+
+	def test_bulk_e_modo_padrao_equivalentes(self):
+		call_command("populate_data", bulk=True, stdout=StringIO())
+
+		totais = (Blocos.objects.count(), Salas.objects.count(), Chaves.objects.count())
+
+		saida = StringIO()
+		call_command("populate_data", stdout=saida)
+
+		self.assertIn("0 bloco(s) criado(s), 0 sala(s) criada(s), 0 chave(s)", saida.getvalue())
+		self.assertEqual(
+			(Blocos.objects.count(), Salas.objects.count(), Chaves.objects.count()), totais
+		)
+
+
+class ListQueryCountTests(APITestCase):
+	@classmethod
+	def setUpTestData(cls):
+		bloco = Blocos.objects.create(nome="Bloco A")
+		outro_bloco = Blocos.objects.create(nome="Bloco B")
+
+		salas = Salas.objects.bulk_create(
+			Salas(nome=f"Sala {i:03}", bloco=bloco if i % 2 else outro_bloco)
+			for i in range(120)
+		)
+		usuarios = Usuarios.objects.bulk_create(
+			Usuarios(nome=f"Usuário {i:03}", id_cortex=1000 + i, setor="ti", tipo="aluno")
+			for i in range(120)
+		)
+		PessoasAutorizadas.objects.bulk_create(
+			PessoasAutorizadas(usuario=usuario, sala=sala)
+			for i, usuario in enumerate(usuarios)
+			for sala in (salas[i], salas[(i + 1) % len(salas)])
+		)
+
+		chaves = Chaves.objects.bulk_create(
+			Chaves(sala=sala, principal=True) for sala in salas
+		)
+		responsaveis = UsuariosResponsaveis.objects.bulk_create(
+			UsuariosResponsaveis(nome=f"Responsável {i:03}", superusuario=usuario)
+			for i, usuario in enumerate(usuarios)
+		)
+		Emprestimos.objects.bulk_create(
+			Emprestimos(
+				chave=chave,
+				usuario_solicitante=usuario,
+				usuario_responsavel=responsavel,
+			)
+			for chave, usuario, responsavel in zip(chaves, usuarios, responsaveis)
+		)
+
+		# Em produção o autovacuum mantém o pg_class.reltuples usado na contagem estimada
+		with connection.cursor() as cursor:
+			for model in (Usuarios, Emprestimos):
+				cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+	def _get(self, path, params=None):
+		params = params or {}
+		params.setdefault("token", "token-teste")
+		return self.client.get(path, params)
+
+	def _assert_query_budget(self, path, budget, params=None):
+		"""
+		Falha se a listagem fizer mais de "budget" queries, seja qual for o tamanho da página.
+		"""
+		for pagination in (5, 100):
+			with CaptureQueriesContext(connection) as queries:
+				response = self._get(path, {**(params or {}), "pagination": pagination})
+
+			self.assertEqual(response.status_code, 200)
+			self.assertLessEqual(
+				len(queries),
+				budget,
+				f"{path} com pagination={pagination} fez {len(queries)} queries:\n"
+				+ "\n".join(query["sql"] for query in queries.captured_queries),
+			)
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_usuarios_e_salas_sem_n_mais_1(self, mocked_token):
+		# count + página + prefetch das autorizações (+ versões do ETag nas salas)
+		casos = [
+			("/chameco/api/v1/usuarios/", "salas", 3),
+			("/chameco/api/v1/salas/", "usuarios", 4),
+		]
+
+		for path, campo, queries in casos:
+			with self.subTest(path=path):
+				with self.assertNumQueries(queries):
+					response = self._get(path, {"pagination": 100})
+
+				self.assertEqual(response.status_code, 200)
+				self.assertEqual(len(response.data["results"]), 100)
+				for item in response.data["results"]:
+					self.assertEqual(len(item[campo]), 2)
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_listagens_dentro_do_orcamento_de_queries(self, mocked_token):
+		# As listagens com ETag fazem uma query a mais, a das versões
+		casos = [
+			("/chameco/api/v1/usuarios/", {}, 3),
+			("/chameco/api/v1/blocos/", {}, 4),
+			("/chameco/api/v1/salas/", {}, 4),
+			("/chameco/api/v1/chaves/", {}, 4),
+			("/chameco/api/v1/chaves/", {"bloco": "bloco a"}, 4),
+			("/chameco/api/v1/responsaveis/", {}, 4),
+			("/chameco/api/v1/emprestimos/", {}, 3),
+			("/chameco/api/v1/emprestimos/", {"finalizados": "false"}, 3),
+		]
+
+		for path, params, budget in casos:
+			with self.subTest(path=path, params=params):
+				self._assert_query_budget(path, budget, params)
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_etag_responde_304_ate_a_proxima_escrita(self, mocked_token):
+		path = "/chameco/api/v1/chaves/"
+		response = self._get(path, {"pagination": 100})
+		etag = response["ETag"]
+
+		# O token não faz parte do ETag; a query das versões é a única feita
+		with self.assertNumQueries(1):
+			response = self.client.get(
+				path, {"pagination": 100, "token": "outro-token"}, headers={"if-none-match": etag}
+			)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response["ETag"], etag)
+
+		# Outros parâmetros geram outro ETag
+		response = self._get(path, {"pagination": 50})
+		self.assertNotEqual(response["ETag"], etag)
+
+		# Escritas por signals (save) e em lote (update) mudam o ETag
+		chave = Chaves.objects.first()
+		chave.disponivel = False
+		with self.captureOnCommitCallbacks(execute=True):
+			chave.save(update_fields=["disponivel"])
+		response = self.client.get(
+			path, {"pagination": 100, "token": "t"}, headers={"if-none-match": etag}
+		)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response["ETag"], etag)
+
+		etag = response["ETag"]
+		Salas.objects.filter(pk=chave.sala_id).update(nome="Renomeada")
+		with self.captureOnCommitCallbacks(execute=True):
+			incrementarVersao("salas")
+		response = self.client.get(
+			path, {"pagination": 100, "token": "t"}, headers={"if-none-match": etag}
+		)
+		self.assertEqual(response.status_code, 200)
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_etag_expira_mesmo_sem_incremento(self, mocked_token):
+		path = "/chameco/api/v1/blocos/"
+		etag = self._get(path)["ETag"]
+
+		# Falha no incremento depois da confirmação: a escrita não vira erro
+		with (
+			patch("chamecoapi.versoes._incrementar", side_effect=RuntimeError("banco indisponível")),
+			self.assertLogs("django", level="ERROR"),
+			self.captureOnCommitCallbacks(execute=True),
+		):
+			Blocos.objects.create(nome="Bloco novo")
+
+		response = self.client.get(path, {"token": "t"}, headers={"if-none-match": etag})
+		self.assertEqual(response.status_code, 304)
+
+		# No período seguinte o ETag muda e os dados novos são enviados
+		with patch("chamecoapi.views.periodoVersoes", return_value=periodoVersoes() + 1):
+			response = self.client.get(path, {"token": "t"}, headers={"if-none-match": etag})
+		self.assertEqual(response.status_code, 200)
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_etag_de_responsaveis_muda_com_o_superusuario(self, mocked_token):
+		path = "/chameco/api/v1/responsaveis/"
+		etag = self._get(path, {"nome_superusuario": "usuario 001"})["ETag"]
+
+		with self.captureOnCommitCallbacks(execute=True):
+			usuario = Usuarios.objects.get(nome="Usuário 001")
+			usuario.nome = "Renomeado"
+			usuario.save()
+
+		response = self.client.get(
+			path, {"nome_superusuario": "usuario 001", "token": "t"}, headers={"if-none-match": etag}
+		)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.data["results"], [])
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_contagem_estimada_e_limitada(self, mocked_token):
+		response = self._get("/chameco/api/v1/emprestimos/")
+		self.assertEqual(response.data["count"], 120)
+		self.assertIsNotNone(response.data["next"])
+
+		with patch.object(EstimatedCountPaginator, "count_limit", 50):
+			response = self._get("/chameco/api/v1/usuarios/", {"nome": "usuario"})
+			self.assertEqual(response.data["count"], 50)
+			self.assertTrue(response.data["count_limitado"])
+
+			response = self._get("/chameco/api/v1/usuarios/", {"nome": "usuario 00"})
+			self.assertEqual(response.data["count"], 10)
+			self.assertFalse(response.data["count_limitado"])
+
+		# Última página: total exato e sem link para a próxima
+		response = self._get("/chameco/api/v1/emprestimos/", {"pagination": 100, "page": 2})
+		self.assertEqual(response.data["count"], 120)
+		self.assertEqual(len(response.data["results"]), 20)
+		self.assertIsNone(response.data["next"])
+
+		response = self._get("/chameco/api/v1/emprestimos/", {"pagination": 100, "page": 3})
+		self.assertEqual(response.status_code, 404)
+
+	@patch("chamecoapi.permissions.isTokenValid", return_value=True)
+	def test_paginacao_por_cursor_percorre_tudo_sem_count(self, mocked_token):
+		for path, model in [
+			("/chameco/api/v1/emprestimos/", Emprestimos),
+			("/chameco/api/v1/usuarios/", Usuarios),
+		]:
+			with self.subTest(path=path):
+				ids = []
+				response = self._get(path, {"tipo_paginacao": "cursor", "pagination": 50})
+
+				while True:
+					self.assertEqual(response.status_code, 200)
+					self.assertNotIn("count", response.data)
+					ids += [item["id"] for item in response.data["results"]]
+
+					if not response.data["next"]:
+						break
+
+					with CaptureQueriesContext(connection) as queries:
+						response = self.client.get(response.data["next"])
+
+					self.assertFalse(
+						any("COUNT(" in query["sql"] for query in queries.captured_queries)
+					)
+
+				self.assertEqual(
+					ids, list(model.objects.order_by("-id").values_list("id", flat=True))
+				)
+
+
+@patch("chamecoapi.permissions.CanUseSystem.has_permission", return_value=True)
+class EmprestimoViewsTests(APITestCase):
+	@classmethod
+	def setUpTestData(cls):
+		bloco = Blocos.objects.create(nome="Bloco E")
+		cls.sala = Salas.objects.create(nome="E02 / Laboratorio de quimica", bloco=bloco)
+		cls.chave = Chaves.objects.create(sala=cls.sala, principal=True)
+
+		cls.professor = Usuarios.objects.create(
+			nome="Ana Professora", id_cortex=201, setor="coordenacao tads", tipo="professor",
+		)
+		cls.aluno = Usuarios.objects.create(
+			nome="Bruno Aluno", id_cortex=202, setor="", tipo="aluno",
+		)
+		cls.responsavel = UsuariosResponsaveis.objects.create(
+			nome="Guarita", superusuario=cls.professor,
+		)
+
+	def _realizar(self, usuario, chave=None):
+		return self.client.post(
+			"/chameco/api/v1/realizar-emprestimo/",
+			{
+				"chave": (chave or self.chave).id,
+				"usuario_solicitante": usuario.id,
+				"usuario_responsavel": self.responsavel.id,
+				"token": "token-teste",
+			},
+			format="json",
+		)
+
+	def test_chave_emprestada_retorna_conflito(self, mocked_permission):
+		response = self._realizar(self.professor)
+		self.assertEqual(response.status_code, 201)
+
+		response = self._realizar(self.professor)
+		self.assertEqual(response.status_code, 409)
+
+		self.chave.refresh_from_db()
+		self.assertFalse(self.chave.disponivel)
+		self.assertEqual(Emprestimos.objects.filter(chave=self.chave).count(), 1)
+
+	def test_finalizar_libera_a_chave(self, mocked_permission):
+		emprestimo = self._realizar(self.professor).data["emprestimo"]
+
+		self.chave.refresh_from_db()
+		self.assertEqual(self.chave.emprestimo_atual_id, emprestimo)
+
+		response = self.client.post(
+			"/chameco/api/v1/finalizar-emprestimo/",
+			{"id_emprestimo": emprestimo, "token": "token-teste"},
+			format="json",
+		)
+		self.assertEqual(response.status_code, 200)
+
+		self.chave.refresh_from_db()
+		self.assertTrue(self.chave.disponivel)
+		self.assertIsNone(self.chave.emprestimo_atual)
+
+	def test_aluno_sem_autorizacao_na_sala(self, mocked_permission):
+		response = self._realizar(self.aluno)
+		self.assertEqual(response.status_code, 400)
+
+		PessoasAutorizadas.objects.create(usuario=self.aluno, sala=self.sala)
+
+		response = self._realizar(self.aluno)
+		self.assertEqual(response.status_code, 201)
+
+	def test_chave_com_emprestimo_em_aberto_retorna_conflito(self, mocked_permission):
+		# Disponibilidade dessincronizada: a constraint de empréstimo aberto ainda barra
+		self._realizar(self.professor)
+		Chaves.objects.filter(pk=self.chave.pk).update(disponivel=True, emprestimo_atual=None)
+
+		response = self._realizar(self.professor)
+
+		self.assertEqual(response.status_code, 409)
+		self.assertEqual(
+			Emprestimos.objects.filter(chave=self.chave, horario_devolucao__isnull=True).count(),
+			1,
+		)
+
+	def test_outras_violacoes_de_integridade_nao_viram_conflito(self, mocked_permission):
+		with patch.object(
+			Emprestimos.objects, "create", side_effect=IntegrityError("violates foreign key constraint")
+		):
+			with self.assertRaises(IntegrityError):
+				self._realizar(self.professor)
+
+	def test_lote_realiza_e_finaliza_com_resultado_por_item(self, mocked_permission):
+		outra_chave = Chaves.objects.create(sala=self.sala, principal=False)
+		item = {
+			"usuario_solicitante": self.aluno.id,
+			"usuario_responsavel": self.responsavel.id,
+		}
+		PessoasAutorizadas.objects.create(usuario=self.aluno, sala=self.sala)
+
+		# As versões só são incrementadas depois da confirmação, fora da transação
+		with self.assertNumQueries(9):
+			response = self.client.post(
+				"/chameco/api/v1/realizar-emprestimo/lote/",
+				{
+					"emprestimos": [
+						{**item, "chave": self.chave.id},
+						{**item, "chave": outra_chave.id},
+						{**item, "chave": self.chave.id},
+						{**item, "chave": 999999},
+					],
+					"token": "token-teste",
+				},
+				format="json",
+			)
+
+		self.assertEqual(response.status_code, 201)
+		resultados = response.data["resultados"]
+		self.assertEqual(
+			[resultado["status"] for resultado in resultados],
+			["success", "success", "error", "error"],
+		)
+		self.assertEqual(
+			Emprestimos.objects.filter(horario_devolucao__isnull=True).count(), 2
+		)
+		outra_chave.refresh_from_db()
+		self.assertEqual(outra_chave.emprestimo_atual_id, resultados[1]["emprestimo"])
+
+		ids = [resultados[0]["emprestimo"], resultados[1]["emprestimo"], 999999]
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.post(
+				"/chameco/api/v1/finalizar-emprestimo/lote/",
+				{"ids_emprestimos": ids, "token": "token-teste"},
+				format="json",
+			)
+
+		# Empréstimos e chaves são travados em ordem crescente do pk, e as chaves
+		# antes de serem liberadas, como na devolução individual
+		travas = [query["sql"] for query in queries if "FOR UPDATE" in query["sql"]]
+		self.assertEqual(len(travas), 2)
+		self.assertTrue(all(trava.endswith('"id" ASC FOR UPDATE') for trava in travas))
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(
+			[resultado["status"] for resultado in response.data["resultados"]],
+			["success", "success", "error"],
+		)
+		self.assertEqual(Chaves.objects.filter(disponivel=True).count(), 2)
+		self.assertFalse(Chaves.objects.filter(emprestimo_atual__isnull=False).exists())
+
+	def test_filtro_por_data_respeita_o_fuso_local(self, mocked_permission):
+		ids = [self._realizar(self.professor).data["emprestimo"]]
+		self.client.post(
+			"/chameco/api/v1/finalizar-emprestimo/",
+			{"id_emprestimo": ids[0], "token": "token-teste"},
+			format="json",
+		)
+		ids.append(self._realizar(self.professor).data["emprestimo"])
+
+		# 23:30 de 10/03 em Fortaleza já é 11/03 em UTC
+		fuso = timezone.get_current_timezone()
+		Emprestimos.objects.filter(pk=ids[0]).update(
+			horario_emprestimo=datetime(2026, 3, 10, 23, 30, tzinfo=fuso)
+		)
+		Emprestimos.objects.filter(pk=ids[1]).update(
+			horario_emprestimo=datetime(2026, 3, 11, 0, 30, tzinfo=fuso)
+		)
+
+		with patch("chamecoapi.permissions.IsTokenValid.has_permission", return_value=True):
+			for data, esperado in [("2026-03-10", ids[0]), ("2026-03-11", ids[1])]:
+				with self.subTest(data=data):
+					response = self.client.get("/chameco/api/v1/emprestimos/", {"data": data})
+					self.assertEqual(
+						[item["id"] for item in response.data["results"]], [esperado]
+					)
+
+	def test_exportar_csv_e_xlsx_com_filtros(self, mocked_permission):
+		aberto = self._realizar(self.professor).data["emprestimo"]
+		outra_chave = Chaves.objects.create(sala=self.sala, principal=False)
+		fechado = self._realizar(self.professor, outra_chave).data["emprestimo"]
+		self.client.post(
+			"/chameco/api/v1/finalizar-emprestimo/",
+			{"id_emprestimo": fechado, "token": "token-teste"},
+			format="json",
+		)
+
+		with patch("chamecoapi.permissions.IsTokenValid.has_permission", return_value=True):
+			response = self.client.get(
+				"/chameco/api/v1/emprestimos/exportar/", {"finalizados": "false"}
+			)
+			self.assertEqual(response.status_code, 200)
+			self.assertTrue(response.streaming)
+			linhas = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+			self.assertEqual(len(linhas), 2)
+			self.assertTrue(linhas[1].startswith(f"{aberto},"))
+			self.assertIn("Ana Professora", linhas[1])
+
+			response = self.client.get(
+				"/chameco/api/v1/emprestimos/exportar/", {"formato": "xlsx"}
+			)
+			self.assertEqual(response.status_code, 200)
+			planilha = load_workbook(BytesIO(b"".join(response.streaming_content))).active
+			self.assertEqual(
+				[linha[0] for linha in planilha.iter_rows(min_row=2, values_only=True)],
+				[fechado, aberto],
+			)
+
+			response = self.client.get(
+				"/chameco/api/v1/emprestimos/exportar/", {"formato": "pdf"}
+			)
+			self.assertEqual(response.status_code, 400)
+
+	def test_exportar_via_asgi_com_iterador_assincrono(self, mocked_permission):
+		emprestimo = self._realizar(self.professor).data["emprestimo"]
+
+		async def exportar(formato):
+			response = await self.async_client.get(
+				"/chameco/api/v1/emprestimos/exportar/", {"formato": formato}
+			)
+			# Um iterador síncrono seria juntado em uma lista inteira pelo Django
+			self.assertTrue(response.is_async)
+			return b"".join([parte async for parte in response.streaming_content])
+
+		with patch("chamecoapi.permissions.IsTokenValid.has_permission", return_value=True):
+			linhas = async_to_sync(exportar)("csv").decode("utf-8-sig").splitlines()
+			planilha = load_workbook(BytesIO(async_to_sync(exportar)("xlsx"))).active
+
+		self.assertEqual(len(linhas), 2)
+		self.assertTrue(linhas[1].startswith(f"{emprestimo},"))
+		self.assertEqual(
+			[linha[0] for linha in planilha.iter_rows(min_row=2, values_only=True)],
+			[emprestimo],
+		)
+
+	@patch.object(politica_admin, "permite", return_value=True)
+	@patch("chamecoapi.permissions.getCortexUser", return_value={"nome_tipo": "", "nome_setores": []})
+	@patch("chamecoapi.permissions.getIdUser", return_value=1)
+	def test_autorizados_da_sala_em_lote(self, mocked_id, mocked_cortex, mocked_admin, mocked_permission):
+		alunos = Usuarios.objects.bulk_create(
+			Usuarios(nome=f"Aluno {i:02}", id_cortex=300 + i, setor="", tipo="aluno")
+			for i in range(40)
+		)
+		ids = [aluno.id for aluno in alunos]
+		PessoasAutorizadas.objects.create(usuario=alunos[0], sala=self.sala)
+		path = f"/chameco/api/v1/salas/{self.sala.id}/autorizados/"
+
+		def autorizar(operacao, usuarios):
+			return self.client.post(
+				path,
+				{"operacao": operacao, "usuarios": usuarios, "token": "token-teste"},
+				format="json",
+			)
+
+		def autorizados():
+			return sorted(
+				PessoasAutorizadas.objects.filter(sala=self.sala).values_list("usuario_id", flat=True)
+			)
+
+		mocked_admin.return_value = False
+		self.assertEqual(autorizar("adicionar", ids).status_code, 403)
+		mocked_admin.return_value = True
+
+		with CaptureQueriesContext(connection) as queries:
+			response = autorizar("adicionar", ids)
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(response.data["usuarios"]), 40)
+		self.assertEqual(autorizados(), ids)
+
+		# Os usuários são validados uma única vez, na ação
+		buscas = [
+			query["sql"] for query in queries
+			if query["sql"].startswith('SELECT "chamecoapi_usuarios"."id" FROM')
+		]
+		self.assertEqual(len(buscas), 1)
+
+		self.assertEqual(autorizar("remover", ids[:30]).status_code, 200)
+		self.assertEqual(autorizados(), ids[30:])
+
+		self.assertEqual(autorizar("substituir", ids[:5]).status_code, 200)
+		self.assertEqual(autorizados(), ids[:5])
+
+		self.assertEqual(autorizar("substituir", []).status_code, 200)
+		self.assertEqual(autorizados(), [])
+
+		self.assertEqual(autorizar("adicionar", []).status_code, 400)
+		self.assertEqual(autorizar("adicionar", [ids[0], 999999]).status_code, 400)
+		self.assertEqual(autorizados(), [])
+
+	def test_trocar_exige_autorizacao_do_novo_solicitante(self, mocked_permission):
+		emprestimo = self._realizar(self.professor).data["emprestimo"]
+
+		def trocar():
+			return self.client.post(
+				"/chameco/api/v1/trocar-emprestimo/",
+				{
+					"id_emprestimo": emprestimo,
+					"novo_solicitante": self.aluno.id,
+					"novo_responsavel": self.responsavel.id,
+					"token": "token-teste",
+				},
+				format="json",
+			)
+
+		self.assertEqual(trocar().status_code, 400)
+
+		PessoasAutorizadas.objects.create(usuario=self.aluno, sala=self.sala)
+
+		self.assertEqual(trocar().status_code, 200)
+		self.assertEqual(
+			Emprestimos.objects.get(horario_devolucao__isnull=True).usuario_solicitante,
+			self.aluno,
+		)
+
+		with patch("chamecoapi.permissions.IsTokenValid.has_permission", return_value=True):
+			response = self.client.get(
+				"/chameco/api/v1/usuarios/", {"sala_autorizada": self.sala.id}
+			)
+
+		self.assertEqual([item["id"] for item in response.data["results"]], [self.aluno.id])
+
+	@patch("chamecoapi.views.isTokenValid", return_value=True)
+	def test_eventos_via_wsgi_indicam_o_painel(self, mocked_token, mocked_permission):
+		response = self.client.get("/chameco/api/v1/chaves/eventos/", {"token": "token-teste"})
+
+		self.assertEqual(response.status_code, 503)
+		self.assertIn("painel/", response.json()["detail"])
+
+	def test_purge_eventos_mantem_o_ultimo(self, mocked_permission):
+		for _ in range(3):
+			EventosChaves.objects.create(chave=self.chave.id, tipo="emprestimo", disponivel=False)
+		EventosChaves.objects.update(criado_em=timezone.now() - timedelta(days=2))
+		recente = EventosChaves.objects.create(chave=self.chave.id, tipo="devolucao", disponivel=True)
+
+		call_command("purge_eventos", stdout=StringIO())
+		self.assertEqual(list(EventosChaves.objects.values_list("id", flat=True)), [recente.id])
+
+		# O último evento é mantido mesmo antigo, como ponto de partida das conexões
+		EventosChaves.objects.update(criado_em=timezone.now() - timedelta(days=2))
+		self.assertEqual(purgarEventos(), 0)
+		self.assertTrue(EventosChaves.objects.filter(pk=recente.pk).exists())
+
+	def test_eventos_das_lacunas_esperam_a_transacao(self, mocked_permission):
+		def criar():
+			return EventosChaves.objects.create(chave=self.chave.id, tipo="emprestimo", disponivel=False)
+
+		inicio = criar()
+		leitor = LeitorEventos()
+		self.assertEqual(leitor.iniciar(), inicio.id)
+
+		primeiro, meio, terceiro = criar(), criar(), criar()
+		# O evento do meio ainda não foi confirmado por uma transação longa
+		EventosChaves.objects.filter(pk=meio.pk).delete()
+		agora = timezone.now()
+
+		with patch(
+			"chamecoapi.eventos.consultarTransacoes",
+			return_value=(agora, agora - timedelta(hours=1)),
+		):
+			self.assertEqual(leitor.ler(), ([primeiro, terceiro], primeiro.id))
+			self.assertEqual(leitor.ler(), ([], primeiro.id))
+
+			# Um leitor novo também espera pelas lacunas das transações abertas
+			self.assertEqual(LeitorEventos().iniciar(), primeiro.id)
+
+			meio.save(force_insert=True)
+			self.assertEqual(leitor.ler(), ([meio], terceiro.id))
+
+		# Sem transações abertas a lacuna é de um rollback e deixa de ser esperada
+		quarto, quinto, sexto = criar(), criar(), criar()
+		EventosChaves.objects.filter(pk=quinto.pk).delete()
+		self.assertEqual(leitor.ler(), ([quarto, sexto], quarto.id))
+		self.assertEqual(leitor.ler(), ([], sexto.id))
+
+	@patch("chamecoapi.permissions.IsTokenValid.has_permission", return_value=True)
+	def test_painel_agrupado_com_o_emprestimo_atual(self, mocked_token, mocked_permission):
+		paineis.clear()
+		self.addCleanup(paineis.clear)
+		reserva = Chaves.objects.create(sala=self.sala, principal=False, descricao="Reserva")
+		emprestimo = self._realizar(self.professor, reserva).data["emprestimo"]
+
+		# Versões + a query do painel
+		with self.assertNumQueries(2):
+			response = self.client.get("/chameco/api/v1/painel/")
+
+		self.assertEqual(response.status_code, 200)
+		[bloco] = response.data
+		self.assertEqual(bloco["nome"], "Bloco E")
+		[sala] = bloco["salas"]
+		self.assertEqual([chave["id"] for chave in sala["chaves"]], [self.chave.id, reserva.id])
+		self.assertIsNone(sala["chaves"][0]["emprestimo"])
+		self.assertFalse(sala["chaves"][1]["disponivel"])
+		self.assertEqual(sala["chaves"][1]["emprestimo"]["id"], emprestimo)
+		self.assertEqual(
+			sala["chaves"][1]["emprestimo"]["usuario_solicitante"],
+			{"id": self.professor.id, "nome": "Ana Professora"},
+		)
+		self.assertEqual(sala["chaves"][1]["emprestimo"]["usuario_responsavel"]["nome"], "Guarita")
+
+		# Sem escritas o painel guardado é reaproveitado
+		with self.assertNumQueries(1):
+			self.client.get("/chameco/api/v1/painel/")
+
+		# A troca muda quem está com a chave
+		PessoasAutorizadas.objects.create(usuario=self.aluno, sala=self.sala)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(
+				"/chameco/api/v1/trocar-emprestimo/",
+				{
+					"id_emprestimo": emprestimo,
+					"novo_solicitante": self.aluno.id,
+					"novo_responsavel": self.responsavel.id,
+					"token": "token-teste",
+				},
+				format="json",
+			)
+
+		response = self.client.get("/chameco/api/v1/painel/")
+		self.assertEqual(
+			response.data[0]["salas"][0]["chaves"][1]["emprestimo"]["usuario_solicitante"]["nome"],
+			"Bruno Aluno",
+		)
+
+	@patch("chamecoapi.permissions.IsTokenValid.has_permission", return_value=True)
+	def test_campus_servido_da_memoria(self, mocked_token, mocked_permission):
+		catalogo.clear()
+		self.addCleanup(catalogo.clear)
+		reserva = Chaves.objects.create(sala=self.sala, principal=False, descricao="Reserva")
+
+		# Versão + blocos, salas e chaves
+		with self.assertNumQueries(4):
+			response = self.client.get("/chameco/api/v1/campus/")
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(
+			json.loads(response.content),
+			[{
+				"id": self.sala.bloco_id,
+				"nome": "Bloco E",
+				"salas": [{
+					"id": self.sala.id,
+					"nome": "E02 / Laboratorio de quimica",
+					"chaves": [
+						{"id": self.chave.id, "descricao": None, "principal": True},
+						{"id": reserva.id, "descricao": "Reserva", "principal": False},
+					],
+				}],
+			}],
+		)
+
+		with self.assertNumQueries(0):
+			response = self.client.get(
+				"/chameco/api/v1/campus/", HTTP_IF_NONE_MATCH=response["ETag"]
+			)
+		self.assertEqual(response.status_code, 304)
+
+		# O empréstimo altera apenas a disponibilidade, que não está no catálogo
+		self._realizar(self.professor, reserva)
+		catalogo.invalidar()
+
+		with self.assertNumQueries(1):
+			self.client.get("/chameco/api/v1/campus/")
+
+		with self.captureOnCommitCallbacks(execute=True):
+			sala = Salas.objects.get(pk=self.sala.pk)
+			sala.nome = "E03 / Laboratorio de fisica"
+			sala.save()
+
+		response = self.client.get("/chameco/api/v1/campus/")
+		self.assertEqual(
+			json.loads(response.content)[0]["salas"][0]["nome"], "E03 / Laboratorio de fisica"
+		)
+
+		# Sem incremento do contador, o período seguinte também monta a árvore
+		with (
+			patch("chamecoapi.catalogo.periodoVersoes", return_value=periodoVersoes() + 1),
+			self.assertNumQueries(4),
+		):
+			catalogo.invalidar()
+			novo = self.client.get("/chameco/api/v1/campus/")
+		self.assertNotEqual(novo["ETag"], response["ETag"])
+
+
+@patch("chamecoapi.views.isTokenValid", return_value=True)
+class EventosChavesStreamTests(APITransactionTestCase):
+	# O distribuidor lê os eventos em outras conexões, que só veem dados confirmados
+
+	def _conteudo(self, **headers):
+		@async_to_sync
+		async def ler():
+			response = await self.async_client.get(
+				"/chameco/api/v1/chaves/eventos/", {"token": "token-teste"}, headers=headers
+			)
+			self.assertEqual(response["Content-Type"], "text/event-stream")
+
+			return b"".join([parte async for parte in response.streaming_content]).decode()
+
+		return ler()
+
+	def _dados(self, conteudo):
+		return [
+			json.loads(linha[len("data: "):])
+			for linha in conteudo.splitlines()
+			if linha.startswith("data: ")
+		]
+
+	def _ids(self, conteudo):
+		return [int(linha[len("id: "):]) for linha in conteudo.splitlines() if linha.startswith("id: ")]
+
+	@patch("chamecoapi.eventos.EVENTOS_DURACAO", 0)
+	def test_eventos_retomados_pelo_last_event_id(self, mocked_token):
+		inicio = EventosChaves.objects.create(chave=1, tipo="criacao", disponivel=True)
+		registrarEventoChave(1, "emprestimo", False)
+		registrarEventoChave(1, "devolucao", True)
+		ultimo = EventosChaves.objects.latest("id").id
+
+		# Sem Last-Event-ID o cliente parte do que já foi lido pelo distribuidor
+		self.assertEqual(self._dados(self._conteudo()), [])
+
+		conteudo = self._conteudo(last_event_id=str(inicio.id))
+		self.assertEqual(
+			self._dados(conteudo),
+			[
+				{"chave": 1, "tipo": "emprestimo", "disponivel": False},
+				{"chave": 1, "tipo": "devolucao", "disponivel": True},
+			],
+		)
+		self.assertEqual(self._ids(conteudo), [ultimo])
+
+		self.assertEqual(self._conteudo(last_event_id=str(ultimo)), "retry: 2000\n\n")
+
+	@patch("chamecoapi.eventos.EVENTOS_DURACAO", 1)
+	@patch("chamecoapi.eventos.EVENTOS_INTERVALO", 0.05)
+	def test_uma_consulta_repassada_a_todas_as_conexoes(self, mocked_token):
+		registrarEventoChave(1, "criacao", True)
+		leituras = []
+		ler = LeitorEventos.ler
+
+		def contar(leitor):
+			leituras.append(leitor)
+			return ler(leitor)
+
+		@async_to_sync
+		async def abrir():
+			async def conectar():
+				response = await self.async_client.get(
+					"/chameco/api/v1/chaves/eventos/", {"token": "token-teste"}
+				)
+				return b"".join([parte async for parte in response.streaming_content]).decode()
+
+			async def registrar():
+				await asyncio.sleep(0.3)
+				await semConexao(registrarEventoChave)(1, "emprestimo", False)
+
+			return await asyncio.gather(conectar(), conectar(), registrar())
+
+		with patch.object(LeitorEventos, "ler", contar):
+			primeiro, segundo, _ = abrir()
+
+		for conteudo in (primeiro, segundo):
+			self.assertEqual(
+				self._dados(conteudo), [{"chave": 1, "tipo": "emprestimo", "disponivel": False}]
+			)
+
+		# Um único leitor para o processo, encerrado junto com as conexões
+		self.assertEqual(len(set(map(id, leituras))), 1)
+		self.assertIsNone(distribuidor._tarefa)
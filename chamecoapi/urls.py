@@ -3,16 +3,21 @@ from rest_framework.routers import SimpleRouter
 
 from .views import (
     BlocosViewSet,
+    CampusViewSet,
     ChavesViewSet,
     EmprestimoDetalhadoViewSet,
+    FinalizarEmprestimoLoteView,
     FinalizarEmprestimoView,
     LoginAPIView,
+    PainelViewSet,
+    RealizarEmprestimoLoteView,
     RealizarEmprestimoView,
     SalasViewSet,
     TrocarEmprestimoView,
     UsuariosResponsaveisViewSet,
     UsuariosViewSet,
     VerifyTokenAPIView,
+    eventos_chaves,
 )
 
 chameco_router = SimpleRouter()
@@ -22,8 +27,12 @@ chameco_router.register("salas", SalasViewSet)
 chameco_router.register("chaves", ChavesViewSet)
 chameco_router.register("responsaveis", UsuariosResponsaveisViewSet)
 chameco_router.register("emprestimos", EmprestimoDetalhadoViewSet)
+chameco_router.register("painel", PainelViewSet, basename="painel")
+chameco_router.register("campus", CampusViewSet, basename="campus")
 urlpatterns = [
     ####### API #######
+    # Antes do router, para "eventos" não ser lido como o id de uma chave
+    path("chaves/eventos/", eventos_chaves, name="chaves-eventos"),
     path("", include(chameco_router.urls)),
     path("login/", LoginAPIView.as_view(), name="login"),
     path("verify-token/", VerifyTokenAPIView.as_view(), name="veerify-token"),
@@ -32,11 +41,21 @@ urlpatterns = [
         RealizarEmprestimoView.as_view(),
         name="realizar-emprestimo",
     ),
+    path(
+        "realizar-emprestimo/lote/",
+        RealizarEmprestimoLoteView.as_view(),
+        name="realizar-emprestimo-lote",
+    ),
     path(
         "finalizar-emprestimo/",
         FinalizarEmprestimoView.as_view(),
         name="finalizar-emprestimo",
     ),
+    path(
+        "finalizar-emprestimo/lote/",
+        FinalizarEmprestimoLoteView.as_view(),
+        name="finalizar-emprestimo-lote",
+    ),
     path(
         "trocar-emprestimo/",
         TrocarEmprestimoView.as_view(),
@@ -0,0 +1,60 @@
+import os
+import time
+
+from django.db import connection, transaction
+from dotenv import load_dotenv
+
+from .models import Versoes
+
+load_dotenv()
+
+# Tempo máximo, em segundos, em que um ETag vale sem nenhuma escrita
+VERSOES_VALIDADE = int(os.environ.get("versoesValidade", 300))
+
+
+def incrementarVersao(*nomes: str):
+    """
+    Incrementa o contador de cada nome, criando-o se ainda não existir, logo
+    após a confirmação da transação atual (ou na hora, fora de uma transação).
+    Assim a linha do contador fica travada só durante o próprio UPDATE, e não
+    até o fim de cada empréstimo, o que enfileiraria os empréstimos de chaves
+    diferentes. Entre a confirmação e o incremento, uma requisição pode
+    receber os dados novos com a versão antiga; o cliente apenas os baixa de
+    novo na próxima requisição.
+    """
+    nomes = sorted(set(nomes))
+    # Uma falha aqui não pode virar erro de uma escrita que já foi confirmada;
+    # fica apenas no log, e os ETags expiram sozinhos (ver periodoVersoes)
+    transaction.on_commit(lambda: _incrementar(nomes), robust=True)
+
+
+def _incrementar(nomes: list[str]):
+    tabela = connection.ops.quote_name(Versoes._meta.db_table)
+    valores = ", ".join(["(%s, 1)"] * len(nomes))
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {tabela} (nome, versao) VALUES {valores} "
+            f"ON CONFLICT (nome) DO UPDATE SET versao = {tabela}.versao + 1",
+            nomes,
+        )
+
+
+def periodoVersoes() -> int:
+    """
+    Número do período atual de VERSOES_VALIDADE segundos, usado junto com as
+    versões: se um incremento se perder (falha depois da confirmação ou queda
+    do processo), os dados desatualizados deixam de ser servidos no máximo
+    até o fim do período.
+    """
+    if VERSOES_VALIDADE <= 0:
+        return 0
+
+    return int(time.time() // VERSOES_VALIDADE)
+
+
+def obterVersoes(*nomes: str) -> tuple[int, ...]:
+    # Uma única query; nomes ainda sem contador valem 0
+    versoes = dict(Versoes.objects.filter(nome__in=nomes).values_list("nome", "versao"))
+
+    return tuple(versoes.get(nome, 0) for nome in nomes)
@@ -1,11 +1,23 @@
 import hashlib
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import jwt
-import requests
-from django.http import HttpRequest, HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Prefetch
+from django.http import (
+    FileResponse,
+    HttpRequest,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.http import parse_etags
 from dotenv import load_dotenv
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import (
@@ -15,21 +27,34 @@ from drf_spectacular.utils import (
     extend_schema,
 )
 from rest_framework import mixins, status
+from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.generics import GenericAPIView
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
 from .business import (
+    cortexRequest,
+    getCortexUser,
     getIdUser,
     getTokens,
+    invalidateCortexUser,
     isTokenValid,
     requestFactory,
     setIdUser,
     setTokens,
 )
+from .catalogo import catalogo
+from .eventos import (
+    registrarEventoChave,
+    registrarEventosChaves,
+    semConexao,
+    streamEventos,
+    talvezPurgarEventos,
+)
+from .exportacao import csvEmprestimos, iterarAsync, partesArquivo, xlsxEmprestimos
 from .models import (
     Blocos,
     Chaves,
@@ -39,20 +64,29 @@ from .models import (
     Usuarios,
     UsuariosResponsaveis,
 )
+from .painel import PAINEL_VERSOES, obterPainel
 from .permissions import (
     CanLogIn,
     CanUseSystem,
     IsAdmin,
+    IsAdminByToken,
     IsTokenValid,
     IsUserAuthenticated,
+    politica_uso_livre,
 )
+from .search import filtrarTexto
 from .serializers import (
+    AutorizadosSalaSerializer,
     AutorizadosSerializer,
+    BlocoCampusSerializer,
+    BlocoPainelSerializer,
     BlocosSerializer,
     ChavesSerializer,
     EmprestimoDetalhadoSerializer,
+    FinalizarEmprestimoLoteSerializer,
     FinalizarEmprestimoSerializer,
     LoginSerializer,
+    RealizarEmprestimoLoteSerializer,
     RealizarEmprestimoSerializer,
     SalasSerializer,
     TrocarEmprestimoSerializer,
@@ -60,11 +94,7 @@ from .serializers import (
     UsuariosSerializer,
     VerifyTokenSerializer,
 )
-
-from .bases import (
-    tipos_usa_sistema_livremente,
-    setores_usa_sistema_livremente,
-)
+from .versoes import incrementarVersao, obterVersoes, periodoVersoes
 
 load_dotenv()
 URL_BASE = os.environ.get("urlBase")
@@ -94,6 +124,215 @@ class DynamicPagination(PageNumberPagination):
         return self.page_size
 
 
+class EstimatedCountPage(Page):
+    def __init__(self, object_list, number, paginator, tem_proxima):
+        super().__init__(object_list, number, paginator)
+        self.tem_proxima = tem_proxima
+
+    def has_next(self):
+        return self.tem_proxima
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator que evita o COUNT(*) exato: sem filtros usa a estimativa do
+    planner (pg_class.reltuples) e com filtros conta no máximo count_limit
+    linhas. Como o total não é exato, cada página busca um item a mais para
+    saber se existe a próxima.
+    """
+
+    count_limit = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+
+        if not queryset.query.where:
+            estimativa = self._estimar_linhas(queryset)
+
+            # Tabela ainda não analisada pelo autovacuum
+            if estimativa < 0:
+                return queryset.count()
+
+            return estimativa
+
+        total = queryset.order_by()[: self.count_limit + 1].count()
+
+        if total > self.count_limit:
+            self.count_capped = True
+            return self.count_limit
+
+        return total
+
+    def _estimar_linhas(self, queryset):
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                [cursor.db.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            linha = cursor.fetchone()
+
+        return linha[0] if linha else -1
+
+    def validate_number(self, number):
+        # Sem o limite superior: o número de páginas é apenas estimado
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages["invalid_page"])
+
+        if number < 1:
+            raise EmptyPage(self.error_messages["min_page"])
+
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+
+        itens = list(self.object_list[bottom : bottom + self.per_page + 1])
+
+        if not itens and number > 1:
+            raise EmptyPage(self.error_messages["no_results"])
+
+        tem_proxima = len(itens) > self.per_page
+        itens = itens[: self.per_page]
+
+        if not tem_proxima:
+            # Na última página o total é conhecido sem consulta extra
+            self.count = bottom + len(itens)
+            self.count_capped = False
+
+        return EstimatedCountPage(itens, number, self, tem_proxima)
+
+
+class EstimatedCountPagination(DynamicPagination):
+    """
+    DynamicPagination com o "count" estimado (ou limitado a count_limit em
+    listagens filtradas, indicado por "count_limitado"), para tabelas grandes.
+    """
+
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        # O "count" continua inteiro; o limite é indicado em um campo à parte
+        response.data["count_limitado"] = self.page.paginator.count_capped
+
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count_limitado"] = {
+            "type": "boolean",
+            "description": (
+                "Verdadeiro quando há mais resultados que o limite de "
+                f"{EstimatedCountPaginator.count_limit} usado em \"count\"."
+            ),
+            "example": False,
+        }
+
+        return response_schema
+
+
+class DynamicCursorPagination(CursorPagination):
+    """
+    Paginação por cursor (keyset) sobre o id: cada página é uma busca pelo
+    índice a partir do último id visto, sem OFFSET nem COUNT(*).
+    """
+
+    page_size = 5
+    page_size_query_param = 'pagination'
+    max_page_size = 100
+    ordering = "-id"
+
+    get_page_size = DynamicPagination.get_page_size
+
+
+class CursorPaginationMixin:
+    """
+    Permite escolher a paginação por cursor com ?tipo_paginacao=cursor,
+    mantendo a paginação por número de página como padrão.
+    """
+
+    cursor_pagination_class = DynamicCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            tipo_paginacao = self.request.query_params.get("tipo_paginacao")
+
+            if tipo_paginacao == "cursor":
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = super().paginator
+
+        return self._paginator
+
+
+class ETagMixin:
+    """
+    ETag calculado a partir das versões em "etag_versoes" (incrementadas a
+    cada escrita, ver signals.py), do período atual (versoes.periodoVersoes)
+    e dos parâmetros da requisição. Se o If-None-Match for igual, a resposta
+    é 304 sem consultar a tabela nem serializar os dados.
+    """
+
+    etag_versoes: tuple[str, ...] = ()
+
+    def get_etag(self, request):
+        # Guardadas para a view poder reaproveitá-las sem outra query
+        self.versoes = obterVersoes(*self.etag_versoes)
+        parametros = sorted(
+            (chave, valor)
+            for chave, valores in request.query_params.lists()
+            if chave != "token"
+            for valor in valores
+        )
+        base = repr((
+            type(self).__name__,
+            self.action,
+            sorted(self.kwargs.items()),
+            parametros,
+            request.accepted_renderer.format,
+            self.versoes,
+            periodoVersoes(),
+        ))
+
+        return f'"{hashlib.sha256(base.encode()).hexdigest()[:32]}"'
+
+    def responder_com_etag(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+
+        if etag in if_none_match or "*" in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        response = handler(request, *args, **kwargs)
+
+        if response.status_code == status.HTTP_200_OK:
+            response["ETag"] = etag
+
+        return response
+
+
+class ETagListRetrieveMixin(ETagMixin):
+    # Aplica o ETag nas ações list e retrieve do ModelViewSet
+
+    def list(self, request, *args, **kwargs):
+        return self.responder_com_etag(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.responder_com_etag(super().retrieve, request, *args, **kwargs)
+
+
 class AuthorizedsNumberPagination(PageNumberPagination):
     page_size = 9999
 
@@ -131,7 +370,7 @@ class LoginAPIView(GenericAPIView):
             "password": serializer["password"],
         }
 
-        response = requests.post(url, json=body)
+        response = cortexRequest("post", url, json=body)
         status_code = response.status_code
         data = {}
 
@@ -154,9 +393,7 @@ class LoginAPIView(GenericAPIView):
 
             setIdUser(hash_token, id_user)
 
-            usuario_cortex = UsuariosViewSet.get_usuario(
-                request, {"id_cortex": id_user}, hash_token
-            )
+            usuario_cortex = getCortexUser(id_user, hash_token)
 
             if CanLogIn().has_permission(
                 request=request, view=self, hash_token=hash_token
@@ -169,16 +406,24 @@ class LoginAPIView(GenericAPIView):
                         id_cortex=id_user
                     )
 
-                    if usuario_cortex.status_code == 200:
-                        setores = ", ".join(
-                            usuario_cortex.json()["nome_setores"]
-                        )
-                        usuario.nome = usuario_cortex.json()["nome"]
-                        usuario.setor = setores
-                        usuario.tipo = usuario_cortex.json()["nome_tipo"]
-                        usuario.email = usuario_cortex.json()["email"]
-
-                        usuario.save()
+                    if usuario_cortex:
+                        dados = {
+                            "nome": usuario_cortex["nome"],
+                            "setor": ", ".join(usuario_cortex["nome_setores"]),
+                            "tipo": usuario_cortex["nome_tipo"],
+                            "email": usuario_cortex["email"],
+                        }
+                        alterados = [
+                            campo for campo, valor in dados.items()
+                            if getattr(usuario, campo) != valor
+                        ]
+
+                        # Salva só o que mudou, sem invalidar os ETags a cada login
+                        if alterados:
+                            for campo in alterados:
+                                setattr(usuario, campo, dados[campo])
+
+                            usuario.save(update_fields=alterados)
 
                         data["usuario"] = usuario.id
                         data["setor"] = usuario.setor
@@ -235,36 +480,42 @@ class VerifyTokenAPIView(GenericAPIView):
 
 
 @extend_schema(tags=["Usuários"])
-class UsuariosViewSet(ModelViewSet):
+class UsuariosViewSet(CursorPaginationMixin, ModelViewSet):
     queryset = Usuarios.objects.all()
     serializer_class = UsuariosSerializer
-    pagination_class = DynamicPagination
+    pagination_class = EstimatedCountPagination
     permission_classes = [IsTokenValid]
 
     http_method_names = ["get", "put", "post", "delete", "head"]
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().prefetch_related(
+            Prefetch(
+                "pessoasautorizadas_set",
+                queryset=PessoasAutorizadas.objects.select_related("sala"),
+            )
+        )
 
         sala_autorizada = self.request.query_params.get("sala_autorizada")
 
         if sala_autorizada and sala_autorizada.isnumeric():
+            # O par (usuario, sala) é único, então o join não duplica usuários
             queryset = queryset.filter(
-                salas_autorizadas__id=int(sala_autorizada)
-            ).distinct()
+                pessoasautorizadas__sala_id=int(sala_autorizada)
+            )
 
         nome = self.request.query_params.get("nome")
         tipo = self.request.query_params.get("tipo")
         setor = self.request.query_params.get("setor")
 
         if nome:
-            queryset = queryset.filter(nome__unaccent__icontains=nome)
+            queryset = filtrarTexto(queryset, "nome", nome)
 
         if tipo:
-            queryset = queryset.filter(tipo__unaccent__icontains=tipo)
+            queryset = filtrarTexto(queryset, "tipo", tipo)
 
         if setor:
-            queryset = queryset.filter(setor__unaccent__icontains=setor)
+            queryset = filtrarTexto(queryset, "setor", setor)
 
         return queryset
 
@@ -272,9 +523,9 @@ class UsuariosViewSet(ModelViewSet):
         description="Filtros de usários do sistema",
         parameters=[
             OpenApiParameter(
-                name="chave_autorizada",
+                name="sala_autorizada",
                 type=OpenApiTypes.INT,
-                description="Filtra os usuários pela possibilidade de pedir empréstimo ou não de determinada chave.",
+                description="Filtra os usuários autorizados a pedir empréstimo das chaves de determinada sala.",
                 required=False,
                 location=OpenApiParameter.QUERY,
             ),
@@ -306,6 +557,21 @@ class UsuariosViewSet(ModelViewSet):
                 required=False,
                 location=OpenApiParameter.QUERY,
             ),
+            OpenApiParameter(
+                name="tipo_paginacao",
+                type=OpenApiTypes.STR,
+                enum=["pagina", "cursor"],
+                description="Com \"cursor\", pagina por cursor (ordenado por id decrescente, sem contagem total), navegando pelos links next/previous.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="cursor",
+                type=OpenApiTypes.STR,
+                description="Cursor opaco retornado em next/previous quando tipo_paginacao=cursor.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
             OpenApiParameter(
                 name="token",
                 type=OpenApiTypes.STR,
@@ -396,6 +662,8 @@ class UsuariosViewSet(ModelViewSet):
             email=response.json()["email"],
         )
 
+        invalidateCortexUser(usuario.id_cortex)
+
         result = {
             "status": "success",
             "detail": {
@@ -445,6 +713,8 @@ class UsuariosViewSet(ModelViewSet):
 
             usuario.save()
 
+            invalidateCortexUser(usuario.id_cortex)
+
             return Response(
                 self.get_serializer(usuario).data, status=status.HTTP_200_OK
             )
@@ -487,11 +757,12 @@ class UsuariosViewSet(ModelViewSet):
 
 
 @extend_schema(tags=["Blocos"])
-class BlocosViewSet(ModelViewSet):
+class BlocosViewSet(ETagListRetrieveMixin, ModelViewSet):
     queryset = Blocos.objects.all()
     serializer_class = BlocosSerializer
     pagination_class = DynamicPagination
     permission_classes = [IsTokenValid]
+    etag_versoes = ("blocos",)
 
     http_method_names = ["get", "post", "put", "delete", "head"]
 
@@ -509,7 +780,7 @@ class BlocosViewSet(ModelViewSet):
         nome = self.request.query_params.get("nome", None)
 
         if nome:
-            queryset = queryset.filter(nome__unaccent__icontains=nome)
+            queryset = filtrarTexto(queryset, "nome", nome)
 
         return queryset
 
@@ -585,11 +856,12 @@ class BlocosViewSet(ModelViewSet):
 
 
 @extend_schema(tags=["Salas"])
-class SalasViewSet(ModelViewSet):
+class SalasViewSet(ETagListRetrieveMixin, ModelViewSet):
     queryset = Salas.objects.all()
     serializer_class = SalasSerializer
     pagination_class = DynamicPagination
     permission_classes = [IsTokenValid]
+    etag_versoes = ("salas", "blocos", "autorizacoes", "usuarios")
 
     http_method_names = ["get", "post", "put", "delete", "head"]
 
@@ -602,17 +874,27 @@ class SalasViewSet(ModelViewSet):
         serializer.save()
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = (
+            super()
+            .get_queryset()
+            .select_related("bloco")
+            .prefetch_related(
+                Prefetch(
+                    "pessoasautorizadas_set",
+                    queryset=PessoasAutorizadas.objects.select_related("usuario"),
+                )
+            )
+        )
 
         nome = self.request.query_params.get("nome", None)
 
         if nome:
-            queryset = queryset.filter(nome__unaccent__icontains=nome)
+            queryset = filtrarTexto(queryset, "nome", nome)
 
         bloco = self.request.query_params.get("bloco", None)
 
         if bloco:
-            queryset = queryset.filter(bloco__nome__unaccent__icontains=bloco)
+            queryset = filtrarTexto(queryset, "bloco__nome", bloco)
 
         return queryset
 
@@ -681,13 +963,52 @@ class SalasViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @extend_schema(
+        description=(
+            "Adiciona, remove ou substitui em lote os usuários autorizados a "
+            "usar a sala. Retorna a sala com a lista de autorizados atualizada."
+        ),
+        responses={200: SalasSerializer},
+    )
+    @action(detail=True, methods=["post"], url_path="autorizados")
+    @transaction.atomic
+    def autorizados(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        operacao = serializer.validated_data["operacao"]
+        usuarios = serializer.validated_data["usuarios"]
+        sala = get_object_or_404(Salas, pk=kwargs["pk"])
+        autorizacoes = PessoasAutorizadas.objects.filter(sala=sala)
+
+        if operacao == "remover":
+            autorizacoes.filter(usuario_id__in=usuarios).delete()
+        else:
+            if operacao == "substituir":
+                autorizacoes.exclude(usuario_id__in=usuarios).delete()
+
+            PessoasAutorizadas.objects.bulk_create(
+                [PessoasAutorizadas(usuario_id=usuario, sala=sala) for usuario in usuarios],
+                ignore_conflicts=True,
+            )
+            incrementarVersao("autorizacoes")
+
+        return Response(SalasSerializer(self.get_object()).data, status=status.HTTP_200_OK)
+
     def get_serializer_class(self):
         if self.request.method == "DELETE":
             return None
 
+        if self.action == "autorizados":
+            return AutorizadosSalaSerializer
+
         return super().get_serializer_class()
 
     def get_permissions(self):
+        # A ação valida os dados uma única vez, depois da permissão
+        if self.action == "autorizados":
+            return [IsAdminByToken()]
+
         if self.request.method in ["PATCH", "DELETE", "PUT", "POST"]:
             return [IsAdmin()]
 
@@ -695,34 +1016,45 @@ class SalasViewSet(ModelViewSet):
 
 
 @extend_schema(tags=["Chaves"])
-class ChavesViewSet(ModelViewSet):
+class ChavesViewSet(ETagListRetrieveMixin, ModelViewSet):
     queryset = Chaves.objects.all()
     serializer_class = ChavesSerializer
     pagination_class = DynamicPagination
     permission_classes = [IsTokenValid]
+    etag_versoes = ("chaves", "salas", "blocos")
 
     http_method_names = ["get", "post", "put", "delete", "head"]
 
+    @transaction.atomic
     def perform_update(self, serializer):
         serializer.validated_data.pop("token")
-        serializer.save()
+        chave = serializer.save()
+        registrarEventoChave(chave.id, "atualizacao", chave.disponivel)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.validated_data.pop("token")
-        serializer.save()
+        chave = serializer.save()
+        registrarEventoChave(chave.id, "criacao", chave.disponivel)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        registrarEventoChave(instance.id, "remocao", None)
+        instance.delete()
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # "nome_sala" do serializer e o __str__ de Chaves leem a sala
+        queryset = super().get_queryset().select_related("sala")
 
         sala = self.request.query_params.get("sala", None)
 
         if sala:
-            queryset = queryset.filter(sala__nome__unaccent__icontains=sala)
+            queryset = filtrarTexto(queryset, "sala__nome", sala)
 
         bloco = self.request.query_params.get("bloco", None)
 
         if bloco:
-            queryset = queryset.filter(sala__bloco__nome__unaccent__icontains=bloco)
+            queryset = filtrarTexto(queryset, "sala__bloco__nome", bloco)
 
         disponivel = self.request.query_params.get("disponivel")
 
@@ -823,11 +1155,13 @@ class ChavesViewSet(ModelViewSet):
 
 
 @extend_schema(tags=["Usuários Responsáveis"])
-class UsuariosResponsaveisViewSet(ModelViewSet):
+class UsuariosResponsaveisViewSet(ETagListRetrieveMixin, ModelViewSet):
     queryset = UsuariosResponsaveis.objects.all()
     serializer_class = UsuariosResponsaveisSerializer
     pagination_class = DynamicPagination
     permission_classes = [IsTokenValid]
+    # O filtro nome_superusuario e o serializer usam dados do usuário
+    etag_versoes = ("responsaveis", "usuarios")
 
     http_method_names = ["get", "post", "put", "delete", "head"]
 
@@ -846,8 +1180,7 @@ class UsuariosResponsaveisViewSet(ModelViewSet):
             "nome_superusuario", None)
 
         if nome_superusuario:
-            queryset = queryset.filter(
-                superusuario__nome__unaccent__icontains=nome_superusuario)
+            queryset = filtrarTexto(queryset, "superusuario__nome", nome_superusuario)
 
         superusuario = self.request.query_params.get("superusuario", None)
 
@@ -857,7 +1190,7 @@ class UsuariosResponsaveisViewSet(ModelViewSet):
         nome = self.request.query_params.get("nome", None)
 
         if nome:
-            queryset = queryset.filter(nome__unaccent__icontains=nome)
+            queryset = filtrarTexto(queryset, "nome", nome)
 
         return queryset
 
@@ -946,13 +1279,91 @@ class UsuariosResponsaveisViewSet(ModelViewSet):
         return super().get_permissions()
 
 
+@extend_schema(tags=["Chaves"])
+class PainelViewSet(ETagMixin, GenericViewSet):
+    """
+    Painel com todas as chaves agrupadas por bloco e sala, com o empréstimo em
+    aberto de cada uma. Substitui as consultas a chaves, empréstimos e
+    usuários feitas a cada atualização da tela.
+    """
+
+    serializer_class = BlocoPainelSerializer
+    permission_classes = [IsTokenValid]
+    pagination_class = None
+    etag_versoes = PAINEL_VERSOES
+
+    http_method_names = ["get"]
+
+    @extend_schema(
+        description="Chaves agrupadas por bloco e sala, com o empréstimo em aberto de cada uma.",
+        parameters=[
+            OpenApiParameter(
+                name="token",
+                type=OpenApiTypes.STR,
+                description="Campo obrigatório para uso do endpoint.",
+                required=True,
+                location=OpenApiParameter.QUERY,
+            ),
+        ],
+        responses={200: BlocoPainelSerializer(many=True)},
+    )
+    def list(self, request, *args, **kwargs):
+        return self.responder_com_etag(self.painel, request)
+
+    def painel(self, request):
+        return Response(obterPainel(self.versoes), status=status.HTTP_200_OK)
+
+
+@extend_schema(tags=["Chaves"])
+class CampusViewSet(GenericViewSet):
+    """
+    Árvore de blocos, salas e chaves servida da memória do worker (ver
+    catalogo.py), já serializada, sem consultar o banco enquanto o catálogo
+    não muda.
+    """
+
+    serializer_class = BlocoCampusSerializer
+    permission_classes = [IsTokenValid]
+    pagination_class = None
+
+    http_method_names = ["get"]
+
+    @extend_schema(
+        description="Blocos com as suas salas e as chaves de cada sala.",
+        parameters=[
+            OpenApiParameter(
+                name="token",
+                type=OpenApiTypes.STR,
+                description="Campo obrigatório para uso do endpoint.",
+                required=True,
+                location=OpenApiParameter.QUERY,
+            ),
+        ],
+        responses={200: BlocoCampusSerializer(many=True)},
+    )
+    def list(self, request, *args, **kwargs):
+        versao, _, conteudo = catalogo.obter()
+        etag = '"campus-%d-%d"' % versao
+
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        response = HttpResponse(conteudo, content_type="application/json")
+        response["ETag"] = etag
+
+        return response
+
+
 @extend_schema(tags=["Empréstimos"])
 class EmprestimoDetalhadoViewSet(
-    GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin
+    CursorPaginationMixin,
+    GenericViewSet,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
 ):
     queryset = Emprestimos.objects.all()
     serializer_class = EmprestimoDetalhadoSerializer
-    pagination_class = DynamicPagination
+    pagination_class = EstimatedCountPagination
     permission_classes = [IsTokenValid]
 
     http_method_names = ["get"]
@@ -970,19 +1381,24 @@ class EmprestimoDetalhadoViewSet(
             data_formatada = None
 
         if data_formatada:
-            queryset = queryset.filter(horario_emprestimo__date=data_formatada)
+            # Intervalo [00:00, 00:00 do dia seguinte) no fuso do sistema, para
+            # que o índice em horario_emprestimo seja usado (o __date converte
+            # a coluna e impede o uso de índices)
+            inicio = timezone.make_aware(data_formatada)
+            queryset = queryset.filter(
+                horario_emprestimo__gte=inicio,
+                horario_emprestimo__lt=inicio + timedelta(days=1),
+            )
 
         solicitante = self.request.query_params.get("solicitante", None)
 
         if solicitante:
-            queryset = queryset.filter(
-                usuario_solicitante__nome__unaccent__icontains=solicitante)
+            queryset = filtrarTexto(queryset, "usuario_solicitante__nome", solicitante)
 
         responsavel = self.request.query_params.get("responsavel", None)
 
         if responsavel:
-            queryset = queryset.filter(
-                usuario_responsavel__nome__unaccent__icontains=responsavel)
+            queryset = filtrarTexto(queryset, "usuario_responsavel__nome", responsavel)
 
         finalizados = self.request.query_params.get("finalizados", None)
 
@@ -1039,6 +1455,21 @@ class EmprestimoDetalhadoViewSet(
                 required=False,
                 location=OpenApiParameter.QUERY,
             ),
+            OpenApiParameter(
+                name="tipo_paginacao",
+                type=OpenApiTypes.STR,
+                enum=["pagina", "cursor"],
+                description="Com \"cursor\", pagina por cursor (ordenado por id decrescente, sem contagem total), navegando pelos links next/previous.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="cursor",
+                type=OpenApiTypes.STR,
+                description="Cursor opaco retornado em next/previous quando tipo_paginacao=cursor.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
             OpenApiParameter(
                 name="token",
                 type=OpenApiTypes.STR,
@@ -1066,6 +1497,95 @@ class EmprestimoDetalhadoViewSet(
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
+    @extend_schema(
+        description="Exporta o histórico de empréstimos (com os mesmos filtros da listagem) em CSV ou XLSX.",
+        parameters=[
+            OpenApiParameter(
+                name="formato",
+                type=OpenApiTypes.STR,
+                enum=["csv", "xlsx"],
+                description="Formato do arquivo (padrão csv).",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="data",
+                type=OpenApiTypes.STR,
+                description="Filtrar pela data do empréstimo.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="solicitante",
+                type=OpenApiTypes.STR,
+                description="Filtrar pelo nome do usuário solicitante.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="responsavel",
+                type=OpenApiTypes.STR,
+                description="Filtrar pelo nome do usuário responsável.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="finalizados",
+                type=OpenApiTypes.BOOL,
+                description="Filtrar pelo status de emprestimo finalizado ou não.",
+                required=False,
+                location=OpenApiParameter.QUERY,
+            ),
+            OpenApiParameter(
+                name="token",
+                type=OpenApiTypes.STR,
+                description="Campo obrigatório para uso do endpoint.",
+                required=True,
+                location=OpenApiParameter.QUERY,
+            ),
+        ],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    @action(detail=False, methods=["get"], url_path="exportar", pagination_class=None)
+    def exportar(self, request, *args, **kwargs):
+        formato = request.query_params.get("formato", "csv").lower()
+        queryset = self.get_queryset()
+        nome_arquivo = f"emprestimos_{datetime.now():%Y%m%d_%H%M%S}.{formato}"
+
+        # Via ASGI o conteúdo precisa ser um iterador assíncrono para não ser
+        # carregado inteiro na memória antes do envio (ver exportacao.iterarAsync)
+        asgi = isinstance(request._request, ASGIRequest)
+
+        if formato == "csv":
+            conteudo = csvEmprestimos(queryset)
+            response = StreamingHttpResponse(
+                iterarAsync(conteudo) if asgi else conteudo,
+                content_type="text/csv; charset=utf-8",
+            )
+            response["Content-Disposition"] = f'attachment; filename="{nome_arquivo}"'
+
+            return response
+
+        if formato == "xlsx":
+            arquivo = xlsxEmprestimos(queryset)
+            response = FileResponse(
+                arquivo,
+                as_attachment=True,
+                filename=nome_arquivo,
+                content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+
+            if asgi:
+                # Mantém os cabeçalhos do FileResponse, que fecha o arquivo ao final
+                response.streaming_content = iterarAsync(partesArquivo(arquivo), 1)
+
+            return response
+
+        return Response(
+            {"status": "error", "message": "Formato inválido. Use csv ou xlsx."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
 
 @extend_schema(tags=["Empréstimos"])
 class RealizarEmprestimoView(GenericAPIView):
@@ -1081,6 +1601,7 @@ class RealizarEmprestimoView(GenericAPIView):
         serializer.validated_data.pop("token")
         serializer.save()
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         try:
             serializer = self.get_serializer(data=request.data)
@@ -1089,7 +1610,11 @@ class RealizarEmprestimoView(GenericAPIView):
 
             data_serializer = serializer.validated_data
 
-            chave = Chaves.objects.get(pk=data_serializer["chave"])
+            # A chave fica travada até o fim da transação, assim dois empréstimos
+            # simultâneos da mesma chave não conseguem passar pela verificação abaixo
+            chave = Chaves.objects.select_for_update().get(
+                pk=data_serializer["chave"]
+            )
 
             usuario_solicitante = Usuarios.objects.get(
                 pk=data_serializer["usuario_solicitante"]
@@ -1115,22 +1640,18 @@ class RealizarEmprestimoView(GenericAPIView):
             }
             return Response(status=status.HTTP_404_NOT_FOUND, data=data)
 
-        if not chave.disponivel:
+        if not chave.disponivel or chave.emprestimo_atual_id:
             data = {
                 "status": "error",
                 "message": "Chave não disponível para empréstimo.",
             }
-            return Response(status=status.HTTP_400_BAD_REQUEST, data=data)
-
-        setor_consta = False
-        for setor in usuario_solicitante.setor.split(","):
-            if setor.strip().lower() in setores_usa_sistema_livremente:
-                setor_consta = True
-                break
+            return Response(status=status.HTTP_409_CONFLICT, data=data)
 
-        if not (usuario_solicitante.tipo.lower() in tipos_usa_sistema_livremente or setor_consta):
+        if not politica_uso_livre.permite(
+            usuario_solicitante.tipo, usuario_solicitante.setor
+        ):
             if not PessoasAutorizadas.objects.filter(
-                sala=chave.sala, usuario=usuario_solicitante
+                usuario_id=usuario_solicitante.id, sala_id=chave.sala_id
             ).exists():
                 data = {
                     "status": "error",
@@ -1138,22 +1659,152 @@ class RealizarEmprestimoView(GenericAPIView):
                 }
                 return Response(status=status.HTTP_400_BAD_REQUEST, data=data)
 
-        emprestimo = Emprestimos.objects.create(
-            chave=chave,
-            usuario_solicitante=usuario_solicitante,
-            usuario_responsavel=usuario_responsavel,
-            horario_emprestimo=horario_emprestimo,
-            observacao=data_serializer.get("observacao", None),
-        )
+        try:
+            with transaction.atomic():
+                emprestimo = Emprestimos.objects.create(
+                    chave=chave,
+                    usuario_solicitante=usuario_solicitante,
+                    usuario_responsavel=usuario_responsavel,
+                    horario_emprestimo=horario_emprestimo,
+                    observacao=data_serializer.get("observacao", None),
+                )
+        except IntegrityError as erro:
+            # Só a constraint emprestimo_aberto_por_chave indica que a chave já
+            # está emprestada; qualquer outra violação (ex.: usuário removido
+            # ao mesmo tempo) é um erro de verdade
+            diag = getattr(erro.__cause__, "diag", None)
+
+            if getattr(diag, "constraint_name", None) != "emprestimo_aberto_por_chave":
+                raise
+
+            data = {
+                "status": "error",
+                "message": "Chave não disponível para empréstimo.",
+            }
+            return Response(status=status.HTTP_409_CONFLICT, data=data)
 
         chave.disponivel = False
-        chave.save()
+        chave.emprestimo_atual = emprestimo
+        chave.save(update_fields=["disponivel", "emprestimo_atual"])
+        registrarEventoChave(chave.id, "emprestimo", False)
 
         data = {"status": "success", "emprestimo": emprestimo.id}
 
         return Response(data, status=status.HTTP_201_CREATED)
 
 
+@extend_schema(tags=["Empréstimos"])
+class RealizarEmprestimoLoteView(GenericAPIView):
+    """
+    Realiza vários empréstimos em uma única requisição e transação, com o
+    resultado de cada item na mesma ordem em que foram enviados.
+    """
+
+    serializer_class = RealizarEmprestimoLoteSerializer
+    http_method_names = ["post"]
+    permission_classes = [CanUseSystem]
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        horario_emprestimo = datetime.now()
+
+        itens = serializer.validated_data["emprestimos"]
+
+        ids_chaves = {item["chave"] for item in itens}
+        ids_solicitantes = {item["usuario_solicitante"] for item in itens}
+
+        # Todas as chaves pedidas são travadas de uma só vez, sempre na ordem do
+        # pk, para que dois lotes com chaves em comum não entrem em deadlock
+        chaves = Chaves.objects.select_for_update().order_by("pk").in_bulk(ids_chaves)
+        solicitantes = Usuarios.objects.in_bulk(ids_solicitantes)
+        responsaveis = UsuariosResponsaveis.objects.in_bulk(
+            {item["usuario_responsavel"] for item in itens}
+        )
+        autorizacoes = set(
+            PessoasAutorizadas.objects.filter(
+                usuario_id__in=ids_solicitantes,
+                sala_id__in={chave.sala_id for chave in chaves.values()},
+            ).values_list("usuario_id", "sala_id")
+        )
+
+        resultados = []
+        novos_emprestimos = []
+        chaves_emprestadas = []
+
+        for item in itens:
+            chave = chaves.get(item["chave"])
+            usuario_solicitante = solicitantes.get(item["usuario_solicitante"])
+            usuario_responsavel = responsaveis.get(item["usuario_responsavel"])
+            resultado = {"chave": item["chave"]}
+            resultados.append(resultado)
+
+            if not chave:
+                mensagem = "Chave não encontrada."
+            elif not usuario_solicitante:
+                mensagem = "Usuário solicitante não encontrado."
+            elif not usuario_responsavel:
+                mensagem = "Usuário responsável não encontrado."
+            elif not chave.disponivel or chave.emprestimo_atual_id:
+                mensagem = "Chave não disponível para empréstimo."
+            elif not (
+                politica_uso_livre.permite(
+                    usuario_solicitante.tipo, usuario_solicitante.setor
+                )
+                or (usuario_solicitante.id, chave.sala_id) in autorizacoes
+            ):
+                mensagem = "Usuário não autorizado para usar a sala."
+            else:
+                mensagem = None
+
+            if mensagem:
+                resultado.update({"status": "error", "message": mensagem})
+                continue
+
+            # Impede que a mesma chave seja emprestada duas vezes no mesmo lote
+            chave.disponivel = False
+
+            novos_emprestimos.append(
+                Emprestimos(
+                    chave=chave,
+                    usuario_solicitante=usuario_solicitante,
+                    usuario_responsavel=usuario_responsavel,
+                    horario_emprestimo=horario_emprestimo,
+                    observacao=item.get("observacao", None),
+                )
+            )
+            chaves_emprestadas.append(chave)
+            resultado["status"] = "success"
+
+        Emprestimos.objects.bulk_create(novos_emprestimos)
+
+        # O bulk_create preenche os ids, então as chaves já podem apontar para os novos empréstimos
+        for chave, emprestimo in zip(chaves_emprestadas, novos_emprestimos):
+            chave.emprestimo_atual = emprestimo
+
+        Chaves.objects.bulk_update(chaves_emprestadas, ["disponivel", "emprestimo_atual"])
+        incrementarVersao("chaves", "emprestimos")
+        registrarEventosChaves(
+            [chave.id for chave in chaves_emprestadas], "emprestimo", False
+        )
+
+        emprestimos = iter(novos_emprestimos)
+        for resultado in resultados:
+            if resultado["status"] == "success":
+                resultado["emprestimo"] = next(emprestimos).id
+
+        data = {
+            "status": "success" if novos_emprestimos else "error",
+            "resultados": resultados,
+        }
+
+        if not novos_emprestimos:
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
 @extend_schema(tags=["Empréstimos"])
 class FinalizarEmprestimoView(GenericAPIView):
     serializer_class = FinalizarEmprestimoSerializer
@@ -1168,6 +1819,7 @@ class FinalizarEmprestimoView(GenericAPIView):
         serializer.validated_data.pop("token")
         serializer.save()
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         try:
             serializer = self.get_serializer(data=request.data)
@@ -1176,7 +1828,7 @@ class FinalizarEmprestimoView(GenericAPIView):
 
             data_serializer = serializer.validated_data
 
-            emprestimo = Emprestimos.objects.get(
+            emprestimo = Emprestimos.objects.select_for_update().get(
                 pk=data_serializer["id_emprestimo"])
 
         except Emprestimos.DoesNotExist:
@@ -1188,17 +1840,95 @@ class FinalizarEmprestimoView(GenericAPIView):
             return Response(status=status.HTTP_400_BAD_REQUEST, data=data)
 
         emprestimo.horario_devolucao = horario_devolucao
-        emprestimo.save()
+        emprestimo.save(update_fields=["horario_devolucao"])
 
-        chave = emprestimo.chave
+        chave = Chaves.objects.select_for_update().get(pk=emprestimo.chave_id)
         chave.disponivel = True
-        chave.save()
+        chave.emprestimo_atual = None
+        chave.save(update_fields=["disponivel", "emprestimo_atual"])
+        registrarEventoChave(chave.id, "devolucao", True)
 
         data = {"status": "success"}
 
         return Response(data, status=status.HTTP_200_OK)
 
 
+@extend_schema(tags=["Empréstimos"])
+class FinalizarEmprestimoLoteView(GenericAPIView):
+    """
+    Finaliza vários empréstimos em uma única requisição e transação, com o
+    resultado de cada item na mesma ordem em que foram enviados.
+    """
+
+    serializer_class = FinalizarEmprestimoLoteSerializer
+    http_method_names = ["post"]
+    permission_classes = [CanUseSystem]
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        horario_devolucao = datetime.now()
+
+        ids_emprestimos = serializer.validated_data["ids_emprestimos"]
+
+        # Travados na ordem do pk, como as chaves nos empréstimos em lote
+        emprestimos = (
+            Emprestimos.objects.select_for_update().order_by("pk").in_bulk(ids_emprestimos)
+        )
+
+        resultados = []
+        finalizados = []
+
+        for id_emprestimo in ids_emprestimos:
+            emprestimo = emprestimos.get(id_emprestimo)
+            resultado = {"emprestimo": id_emprestimo}
+            resultados.append(resultado)
+
+            if not emprestimo:
+                resultado.update(
+                    {"status": "error", "message": "Emprestimo não encontrado."}
+                )
+                continue
+
+            if emprestimo.horario_devolucao:
+                resultado.update(
+                    {"status": "error", "message": "Emprestimo já finalizado."}
+                )
+                continue
+
+            emprestimo.horario_devolucao = horario_devolucao
+            finalizados.append(emprestimo)
+            resultado["status"] = "success"
+
+        chaves_devolvidas = {emprestimo.chave_id for emprestimo in finalizados}
+
+        Emprestimos.objects.bulk_update(finalizados, ["horario_devolucao"])
+
+        # Trava as chaves, em ordem, como a devolução individual, antes de liberá-las
+        list(
+            Chaves.objects.select_for_update()
+            .filter(pk__in=chaves_devolvidas)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        Chaves.objects.filter(pk__in=chaves_devolvidas).update(
+            disponivel=True, emprestimo_atual=None
+        )
+        incrementarVersao("chaves", "emprestimos")
+        registrarEventosChaves(sorted(chaves_devolvidas), "devolucao", True)
+
+        data = {
+            "status": "success" if finalizados else "error",
+            "resultados": resultados,
+        }
+
+        if not finalizados:
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
 @extend_schema(tags=["Empréstimos"])
 class TrocarEmprestimoView(GenericAPIView):
     serializer_class = TrocarEmprestimoSerializer
@@ -1213,6 +1943,7 @@ class TrocarEmprestimoView(GenericAPIView):
         serializer.validated_data.pop("token")
         serializer.save()
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         try:
             serializer = self.get_serializer(data=request.data)
@@ -1221,8 +1952,10 @@ class TrocarEmprestimoView(GenericAPIView):
 
             data_serializer = serializer.validated_data
 
-            emprestimo = Emprestimos.objects.get(
-                pk=data_serializer["id_emprestimo"]
+            emprestimo = (
+                Emprestimos.objects.select_related("chave")
+                .select_for_update(of=("self",))
+                .get(pk=data_serializer["id_emprestimo"])
             )
 
             novo_solicitante = Usuarios.objects.get(
@@ -1253,15 +1986,11 @@ class TrocarEmprestimoView(GenericAPIView):
             }
             return Response(status=status.HTTP_400_BAD_REQUEST, data=data)
 
-        setor_consta = False
-        for setor in usuario_solicitante.setor.split(","):
-            if setor.strip().lower() in setores_usa_sistema_livremente:
-                setor_consta = True
-                break
-
-        if not (usuario_solicitante.tipo.lower() in tipos_usa_sistema_livremente or setor_consta):
+        if not politica_uso_livre.permite(
+            novo_solicitante.tipo, novo_solicitante.setor
+        ):
             if not PessoasAutorizadas.objects.filter(
-                usuario=novo_solicitante, sala=emprestimo.chave.sala
+                usuario_id=novo_solicitante.id, sala_id=emprestimo.chave.sala_id
             ).exists():
                 data = {
                     "status": "error",
@@ -1270,15 +1999,74 @@ class TrocarEmprestimoView(GenericAPIView):
                 return Response(status=status.HTTP_400_BAD_REQUEST, data=data)
 
         emprestimo.horario_devolucao = horario_troca
-        emprestimo.save()
+        emprestimo.save(update_fields=["horario_devolucao"])
+
+        chave = emprestimo.chave
 
         emprestimo = Emprestimos.objects.create(
-            chave=emprestimo.chave,
+            chave=chave,
             usuario_solicitante=novo_solicitante,
             usuario_responsavel=novo_responsavel,
             horario_emprestimo=horario_troca,
         )
 
+        chave.emprestimo_atual = emprestimo
+        chave.save(update_fields=["emprestimo_atual"])
+        registrarEventoChave(chave.id, "troca", False)
+
         data = {"status": "success"}
 
         return Response(data, status=status.HTTP_200_OK)
+
+
+async def eventos_chaves(request: HttpRequest) -> HttpResponse:
+    """
+    Stream (Server-Sent Events) das alterações de disponibilidade das chaves,
+    para que os painéis não precisem consultar a listagem de chaves
+    periodicamente. O token vai na query string, pois o EventSource do
+    navegador não envia cabeçalhos, e a reconexão continua a partir do
+    cabeçalho Last-Event-ID (ou do parâmetro "ultimo_evento").
+    """
+    if request.method != "GET":
+        return JsonResponse(
+            {"detail": f'Método "{request.method}" não permitido.'}, status=405
+        )
+
+    # A thread da requisição fica ociosa enquanto o stream está aberto, então não
+    # pode guardar uma conexão com o banco
+    if not await semConexao(isTokenValid)(request.GET.get("token")):
+        return JsonResponse(
+            {"detail": "Você não tem permissão para executar essa ação."}, status=403
+        )
+
+    # Via WSGI cada conexão aberta ocuparia um worker inteiro durante EVENTOS_DURACAO
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {
+                "detail": (
+                    "O stream de eventos exige que o sistema seja servido via ASGI. "
+                    "Consulte periodicamente o endpoint painel/, que responde 304 "
+                    "enquanto nada muda."
+                )
+            },
+            status=503,
+        )
+
+    await semConexao(talvezPurgarEventos)()
+
+    ultimo_id = request.headers.get("Last-Event-ID") or request.GET.get("ultimo_evento")
+
+    try:
+        ultimo_id = int(ultimo_id)
+    except (TypeError, ValueError):
+        # Sem histórico: parte do cursor do distribuidor (ver streamEventos)
+        ultimo_id = None
+
+    response = StreamingHttpResponse(
+        streamEventos(ultimo_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Desativa o buffer do Nginx para que os eventos cheguem na hora
+    response["X-Accel-Buffering"] = "no"
+
+    return response